@@ -0,0 +1,274 @@
+try:
+    import micropython
+    native = micropython.native
+except ImportError:  # CPython, e.g. when testing on the host
+    def native(f):
+        return f
+
+# IMA-ADPCM step sizes and index adjustments
+STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+)
+INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+ADPCM_HEADER_SIZE = 4
+
+
+def _ulaw_decode_table():
+    table = []
+    for code in range(256):
+        code = ~code & 0xFF
+        exponent = (code >> 4) & 0x07
+        magnitude = ((((code & 0x0F) << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+        table.append(-magnitude if code & 0x80 else magnitude)
+    return tuple(table)
+
+
+ULAW_DECODE = _ulaw_decode_table()
+
+BUILTIN_CODECS = ('pcm', 'ulaw', 'adpcm')
+
+# Decoders for codecs this firmware does not implement itself (e.g. Opus from a native C module), keyed by
+# codec name: (decode(data, out, num_bytes) -> PCM bytes written, max_decoded_size(data_bytes) -> PCM bytes).
+# Only codecs that can be decoded are offered to the server for the speaker direction.
+DECODERS = {}
+
+
+def register_decoder(codec, decode, max_decoded_size):
+    DECODERS[codec] = (decode, max_decoded_size)
+
+
+def can_decode(codec):
+    return codec in BUILTIN_CODECS or codec in DECODERS
+
+
+def encoded_size(codec, pcm_bytes):
+    """
+    Returns the number of bytes `codec` produces for `pcm_bytes` of 16-bit PCM.
+    """
+    samples = pcm_bytes // 2
+    if codec == 'adpcm':
+        return ADPCM_HEADER_SIZE + (samples + 1) // 2
+    if codec == 'ulaw':
+        return samples
+    return pcm_bytes
+
+
+def decoded_size(codec, data_bytes):
+    """
+    Returns the number of 16-bit PCM bytes `codec` produces for `data_bytes` of encoded audio.
+    """
+    if codec == 'adpcm':
+        return max(0, data_bytes - ADPCM_HEADER_SIZE) * 4
+    if codec == 'ulaw':
+        return data_bytes * 2
+    if codec in DECODERS:
+        return DECODERS[codec][1](data_bytes)
+    return data_bytes
+
+
+@native
+def ulaw_encode(pcm, out, num_bytes):
+    """
+    Encodes 16-bit little-endian PCM into G.711 u-law, one byte per sample.
+
+    :param pcm: bytearray or memoryview holding the PCM samples.
+    :param out: Preallocated output buffer, at least num_bytes // 2 long.
+    :param num_bytes: Number of valid PCM bytes in `pcm`.
+    :return: Number of bytes written to `out`.
+    """
+    n = num_bytes // 2
+    for i in range(n):
+        sample = pcm[2 * i] | (pcm[2 * i + 1] << 8)
+        sign = 0
+        if sample & 0x8000:
+            sample = 0x10000 - sample
+            sign = 0x80
+        if sample > ULAW_CLIP:
+            sample = ULAW_CLIP
+        sample += ULAW_BIAS
+        exponent = 7
+        mask = 0x4000
+        while exponent > 0 and not sample & mask:
+            exponent -= 1
+            mask >>= 1
+        out[i] = ~(sign | (exponent << 4) | ((sample >> (exponent + 3)) & 0x0F)) & 0xFF
+    return n
+
+
+@native
+def ulaw_decode(data, out, num_bytes):
+    """
+    Decodes G.711 u-law into 16-bit little-endian PCM.
+
+    :param data: bytes, bytearray or memoryview of u-law codes.
+    :param out: Preallocated output buffer, at least 2 * num_bytes long.
+    :param num_bytes: Number of valid bytes in `data`.
+    :return: Number of PCM bytes written to `out`.
+    """
+    table = ULAW_DECODE
+    for i in range(num_bytes):
+        sample = table[data[i]]
+        out[2 * i] = sample & 0xFF
+        out[2 * i + 1] = (sample >> 8) & 0xFF
+    return 2 * num_bytes
+
+
+class AdpcmEncoder:
+    # IMA-ADPCM encoder. Each packet starts with a 4-byte header (int16 predictor, step index, reserved)
+    # so packets decode independently of each other; codes follow two per byte, low nibble first.
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    @native
+    def encode(self, pcm, out, num_bytes):
+        """
+        Encodes 16-bit little-endian PCM into one ADPCM packet.
+
+        :param pcm: bytearray or memoryview holding the PCM samples.
+        :param out: Preallocated output buffer, at least encoded_size('adpcm', num_bytes) long.
+        :param num_bytes: Number of valid PCM bytes in `pcm`.
+        :return: Number of bytes written to `out`.
+        """
+        predictor = self.predictor
+        index = self.index
+        out[0] = predictor & 0xFF
+        out[1] = (predictor >> 8) & 0xFF
+        out[2] = index
+        out[3] = 0
+        steps = STEP_TABLE
+        index_table = INDEX_TABLE
+        n = num_bytes // 2
+        pos = ADPCM_HEADER_SIZE
+        for i in range(n):
+            sample = pcm[2 * i] | (pcm[2 * i + 1] << 8)
+            if sample & 0x8000:
+                sample -= 0x10000
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+            if code & 8:
+                predictor -= delta
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += delta
+                if predictor > 32767:
+                    predictor = 32767
+            index += index_table[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            if i & 1:
+                out[pos] |= code << 4
+                pos += 1
+            else:
+                out[pos] = code
+        if n & 1:
+            pos += 1
+        self.predictor = predictor
+        self.index = index
+        return pos
+
+
+@native
+def adpcm_decode(data, out, num_bytes):
+    """
+    Decodes one IMA-ADPCM packet into 16-bit little-endian PCM.
+
+    :param data: bytes, bytearray or memoryview holding the packet.
+    :param out: Preallocated output buffer, at least decoded_size('adpcm', num_bytes) long.
+    :param num_bytes: Number of valid bytes in `data`.
+    :return: Number of PCM bytes written to `out`.
+    """
+    if num_bytes <= ADPCM_HEADER_SIZE:
+        return 0
+    predictor = data[0] | (data[1] << 8)
+    if predictor & 0x8000:
+        predictor -= 0x10000
+    index = data[2]
+    if index > 88:
+        index = 88
+    steps = STEP_TABLE
+    index_table = INDEX_TABLE
+    pos = 0
+    for i in range(ADPCM_HEADER_SIZE, num_bytes):
+        byte = data[i]
+        for _ in range(2):
+            code = byte & 0x0F
+            byte >>= 4
+            step = steps[index]
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            if code & 8:
+                predictor -= delta
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += delta
+                if predictor > 32767:
+                    predictor = 32767
+            index += index_table[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            out[pos] = predictor & 0xFF
+            out[pos + 1] = (predictor >> 8) & 0xFF
+            pos += 2
+    return pos
+
+
+class AudioCodec:
+    # Encodes microphone audio and decodes speaker audio with the codec agreed with the server ('pcm' until then)
+    def __init__(self, name='pcm'):
+        self.name = name
+        self.encoder = AdpcmEncoder()
+
+    def encode(self, pcm, out, num_bytes):
+        if self.name == 'adpcm':
+            return self.encoder.encode(pcm, out, num_bytes)
+        if self.name == 'ulaw':
+            return ulaw_encode(pcm, out, num_bytes)
+        out[:num_bytes] = pcm[:num_bytes]
+        return num_bytes
+
+    def decode(self, data, out, num_bytes):
+        if self.name == 'adpcm':
+            return adpcm_decode(data, out, num_bytes)
+        if self.name == 'ulaw':
+            return ulaw_decode(data, out, num_bytes)
+        if self.name in DECODERS:
+            return DECODERS[self.name][0](data, out, num_bytes)
+        out[:num_bytes] = data[:num_bytes]
+        return num_bytes
@@ -1,21 +1,44 @@
 from i2s_audio import play_audio_sample, init_audio_input, init_audio_output, play_audio_from_file, \
     cleanup_audio_output, cleanup_audio_input
+from audio_codec import AudioCodec, can_decode, encoded_size, decoded_size
+from jitter_buffer import JitterBuffer
+from vad import VoiceActivityDetector
 from collections import deque
 from machine import Pin, WDT, I2S
 import gc
+import log
 import uasyncio as asyncio
+import ujson
+import ustruct
 import utime
+try:
+    from micropython import const
+except ImportError:  # CPython, e.g. when testing on the host
+    from log import const
+
+# Set to 1 to log every uplink frame and downlink payload. With 0 the compiler drops those call sites,
+# so the per-packet hot paths pay nothing for them.
+_TRACE = const(0)
+
+# Optional uplink frame header, little-endian: sequence number (uint16), utterance id (uint16) and
+# capture time in ms (uint32). The server uses it to reorder frames, drop duplicates and fill gaps.
+UPLINK_HEADER = "<HHI"
+UPLINK_HEADER_SIZE = 8
 
 
 class AudioSystem:
     def __init__(self, button_pin, mqtt_mic_topic, mqtt_audio_topic, client, sample_rate_in_hz_input=16000,
-                 sample_rate_in_hz_output=16000):
+                 sample_rate_in_hz_output=16000, mqtt_ctrl_ack_topic=None, jitter_buffer_bytes=32000,
+                 preroll_ms=200, play_chunk_bytes=1024, uplink_frame_ms=160, uplink_frames=3,
+                 mqtt_ctrl_topic=None, vad_enabled=True):
         # Button for starting/stopping recording
         self.button_pin = Pin(button_pin, Pin.IN, Pin.PULL_UP)
         self.is_recording = False
 
         self.mqtt_mic_topic = mqtt_mic_topic
         self.mqtt_audio_topic = mqtt_audio_topic
+        self.mqtt_ctrl_ack_topic = mqtt_ctrl_ack_topic
+        self.mqtt_ctrl_topic = mqtt_ctrl_topic
         self.client = client
 
         # Initialize audio input and output with different sample rates
@@ -28,8 +51,62 @@ class AudioSystem:
         self.sample_rate_in_hz_input = sample_rate_in_hz_input
         self.sample_rate_in_hz_output = sample_rate_in_hz_output
 
-        self.mic_samples = bytearray(1000)
-        self.mic_samples_mv = memoryview(self.mic_samples)
+        # Microphone audio is read from I2S in small pieces and published in uplink_frame_ms frames.
+        # Frames live in a small preallocated ring; each slot reserves room for the optional header.
+        # When publishing falls behind, the oldest unsent frame is overwritten (drop-oldest).
+        self.mic_read_bytes = 1000
+        self.uplink_frame_bytes = max(self.mic_read_bytes, uplink_frame_ms * sample_rate_in_hz_input * 2 // 1000)
+        self.uplink_slots = [bytearray(UPLINK_HEADER_SIZE + self.uplink_frame_bytes) for _ in range(uplink_frames)]
+        self.uplink_slots_mv = [memoryview(slot) for slot in self.uplink_slots]
+        self.uplink_lengths = [0] * uplink_frames
+        self.uplink_head = 0  # Oldest frame waiting to be published
+        self.uplink_pending = 0
+        self.uplink_fill = 0  # Bytes captured into the slot after the pending ones
+        self.uplink_header = False  # Enabled once the server acknowledges it
+        self.uplink_seq = 0
+        self.utterance_id = 0
+        self.uplink_sent = 0
+        self.uplink_dropped = 0
+
+        # Only speech is uploaded while the button is held: leading silence is discarded except for a short
+        # pre-roll (at most half a frame, so the copy never overlaps) and the server is told when speech ends
+        self.vad = VoiceActivityDetector() if vad_enabled else None
+        self.vad_preroll_bytes = min(self.uplink_frame_bytes // 2, 2 * self.mic_read_bytes)
+        self.uplink_suppressed = 0
+        self.release_pending = False  # Button released without the VAD: end the utterance from the record loop
+
+        # Raw PCM until the server acknowledges a codec; buffers are allocated once per codec
+        self.codec = AudioCodec()
+        self.speaker_codec = self.codec
+        self.mic_encoded = None
+        self.speaker_pcm = None
+
+        # Incoming TTS audio goes through a jitter buffer so the MQTT callback never blocks on I2S;
+        # the playback task drains it in small chunks once the pre-roll is buffered
+        bytes_per_ms = sample_rate_in_hz_output * 2 // 1000
+        self.jitter_buffer = JitterBuffer(capacity=jitter_buffer_bytes, preroll_bytes=preroll_ms * bytes_per_ms)
+        # Set by the button IRQ: the ring is only touched outside interrupts, so the clear happens in flush_if_pending()
+        self.flush_pending = False
+        self.play_buffer = bytearray(play_chunk_bytes)
+        self.play_buffer_mv = memoryview(self.play_buffer)
+
+    def set_codec(self, name, downlink=None):
+        # The server may choose a different codec for the speaker direction
+        downlink = downlink or name
+        self.codec = AudioCodec(name)
+        if not can_decode(downlink):
+            # send_hello never offers such a codec; playing undecoded data would only produce noise
+            log.error("No decoder for downlink codec", downlink, "- speaker audio is dropped")
+            self.speaker_codec = None
+        else:
+            self.speaker_codec = AudioCodec(downlink)
+        self.mic_encoded = None if name == 'pcm' else \
+            bytearray(UPLINK_HEADER_SIZE + encoded_size(name, self.uplink_frame_bytes))
+        # Large enough for one downlink MQTT message (10000 bytes) of the chosen codec
+        self.speaker_pcm = None if downlink == 'pcm' or self.speaker_codec is None else \
+            bytearray(decoded_size(downlink, 10000))
+        gc.collect()
+        log.info("Audio codec:", name, "downlink:", downlink)
 
     def init_audio_input(self, sample_rate_in_hz=16000):
         return init_audio_input(mono=True, sample_rate_in_hz=sample_rate_in_hz)
@@ -42,14 +119,21 @@ class AudioSystem:
 
         if pin.value() == 0:  # If button pressed
             self.is_recording = True
+            if not self.vad:
+                self.utterance_id += 1  # Without the VAD every press is one utterance
+                self.release_pending = False
+            # The user is talking over the reply: drop whatever is still buffered (done by the playback task,
+            # clearing here could interleave with a readinto() in progress)
+            self.flush_pending = True
 
             self.audio_in = init_audio_input(mono=True, sample_rate_in_hz=self.sample_rate_in_hz_input)
 
             cleanup_audio_output(self.audio_out)
 
-            print("Start Record")
+            log.info("Start Record")
         elif pin.value() == 1:  # If button released
             self.is_recording = False
+            self.release_pending = not self.vad
 
             self.audio_out = init_audio_output(mono=True, sample_rate_in_hz=self.sample_rate_in_hz_output)
 
@@ -59,23 +143,169 @@ class AudioSystem:
             # 资源回收
             gc.collect()
 
-            print("Stop Record")
+            log.info("Stop Record")
+
+    def capture_slot(self):
+        return (self.uplink_head + self.uplink_pending) % len(self.uplink_slots)
+
+    def push_frame(self):
+        slot = self.capture_slot()
+        if self.uplink_header:
+            ustruct.pack_into(UPLINK_HEADER, self.uplink_slots[slot], 0, self.uplink_seq & 0xFFFF,
+                              self.utterance_id & 0xFFFF, utime.ticks_ms() & 0xFFFFFFFF)
+        self.uplink_seq += 1
+        self.uplink_lengths[slot] = self.uplink_fill
+        self.uplink_fill = 0
+        if self.uplink_pending == len(self.uplink_slots) - 1:
+            # Ring full (publishing stalled): drop the oldest frame so latency stays bounded
+            self.uplink_head = (self.uplink_head + 1) % len(self.uplink_slots)
+            self.uplink_dropped += 1
+        else:
+            self.uplink_pending += 1
+
+    def publish_frame(self):
+        slot = self.uplink_slots_mv[self.uplink_head]
+        n = self.uplink_lengths[self.uplink_head]
+        start = 0 if self.uplink_header else UPLINK_HEADER_SIZE
+        if self.mic_encoded is None:
+            payload = slot[start:UPLINK_HEADER_SIZE + n]
+        else:
+            self.mic_encoded[:UPLINK_HEADER_SIZE] = slot[:UPLINK_HEADER_SIZE]
+            encoded = memoryview(self.mic_encoded)
+            n = self.codec.encode(slot[UPLINK_HEADER_SIZE:], encoded[UPLINK_HEADER_SIZE:], n)
+            payload = encoded[start:UPLINK_HEADER_SIZE + n]
+        self.client.publish(self.mqtt_mic_topic, payload, qos=0)
+        if _TRACE:
+            log.debug("Uplink frame", self.uplink_sent, len(payload), "bytes")
+        self.uplink_head = (self.uplink_head + 1) % len(self.uplink_slots)
+        self.uplink_pending -= 1
+        self.uplink_sent += 1
+
+    def trim_to_preroll(self):
+        # Silence before speech: keep only the newest pre-roll bytes at the start of the slot
+        slot = self.uplink_slots_mv[self.capture_slot()]
+        keep = self.vad_preroll_bytes
+        end = UPLINK_HEADER_SIZE + self.uplink_fill
+        slot[UPLINK_HEADER_SIZE:UPLINK_HEADER_SIZE + keep] = slot[end - keep:end]
+        self.uplink_suppressed += self.uplink_fill - keep
+        self.uplink_fill = keep
+
+    def end_of_speech(self):
+        # Flush the utterance, then tell the server so recognition can finish without waiting for a timeout
+        if self.uplink_fill:
+            self.push_frame()
+        while self.uplink_pending:
+            self.publish_frame()
+        if self.mqtt_ctrl_topic:
+            self.client.publish(self.mqtt_ctrl_topic, b'{"event": "speech_end"}', qos=0)
 
     async def record_audio(self):
         while True:
             try:
                 if self.is_recording:
-                    num_bytes_read_from_mic = self.audio_in.readinto(self.mic_samples_mv)
+                    slot = self.uplink_slots_mv[self.capture_slot()]
+                    start = UPLINK_HEADER_SIZE + self.uplink_fill
+                    end = min(start + self.mic_read_bytes, len(slot))
+                    num_bytes_read_from_mic = self.audio_in.readinto(slot[start:end])
                     if num_bytes_read_from_mic > 0:
-                        self.client.publish(self.mqtt_mic_topic, self.mic_samples[:num_bytes_read_from_mic], qos=0)
-                        await asyncio.sleep_ms(5)
-                        print("Audio data published")
-                await asyncio.sleep_ms(5)
+                        self.uplink_fill += num_bytes_read_from_mic
+                        in_speech, ended = True, False
+                        if self.vad:
+                            was_speaking = self.vad.in_speech
+                            in_speech, ended = self.vad.process(slot[start:], num_bytes_read_from_mic)
+                            if in_speech and not was_speaking:
+                                self.utterance_id += 1
+                        if ended:
+                            self.end_of_speech()
+                        elif not in_speech:
+                            if self.uplink_fill == self.uplink_frame_bytes:
+                                self.trim_to_preroll()
+                        elif self.uplink_fill == self.uplink_frame_bytes:
+                            self.push_frame()
+                elif self.vad and self.vad.in_speech:
+                    # Button released mid-utterance
+                    self.vad.reset()
+                    self.end_of_speech()
+                elif self.release_pending:
+                    # Button released: send the partial last frame and tell the server the utterance ended,
+                    # so it flushes its reorder window now instead of at the start of the next utterance
+                    self.release_pending = False
+                    self.end_of_speech()
+                elif self.uplink_fill and self.vad:
+                    # Only silence was captured since the last utterance
+                    self.uplink_suppressed += self.uplink_fill
+                    self.uplink_fill = 0
+                if self.uplink_pending:
+                    self.publish_frame()
+                    await asyncio.sleep_ms(0)
+                else:
+                    if not self.is_recording and self.uplink_sent:
+                        log.info("Uplink frames sent:", self.uplink_sent, "dropped:", self.uplink_dropped,
+                                 "silent bytes suppressed:", self.uplink_suppressed)
+                        self.uplink_sent = self.uplink_dropped = self.uplink_suppressed = 0
+                    await asyncio.sleep_ms(5)
             except Exception as e:
-                print(f"Error collecting microphone data: {e}")
+                log.limited("mic", 1000, log.ERROR, "Error collecting microphone data:", e)
                 await asyncio.sleep_ms(10)
 
+    def flush_if_pending(self):
+        if self.flush_pending:
+            self.flush_pending = False
+            self.jitter_buffer.clear()
+
+    def play_chunk(self):
+        n = self.jitter_buffer.readinto(self.play_buffer_mv)
+        if n:
+            self.audio_out.write(self.play_buffer_mv[:n])
+        return n
+
+    async def playback(self):
+        # Drains the jitter buffer; each I2S write is at most play_chunk_bytes so MQTT keeps being serviced
+        while True:
+            try:
+                self.flush_if_pending()
+                if not self.is_recording and self.jitter_buffer.readable():
+                    self.play_chunk()
+                    if not self.jitter_buffer.playing:
+                        log.info("Playback drained", self.jitter_buffer.stats())
+                    await asyncio.sleep_ms(0)
+                else:
+                    await asyncio.sleep_ms(10)
+            except Exception as e:
+                log.limited("playback", 1000, log.ERROR, "Error playing audio:", e)
+                await asyncio.sleep_ms(10)
+
+    def enqueue_audio(self, data, num_bytes):
+        if self.is_recording:
+            return  # Speaker is released while recording
+        self.flush_if_pending()  # Never append a new reply behind audio the user interrupted
+        mv = memoryview(data)
+        offset = self.jitter_buffer.write(mv, num_bytes)
+        if offset < num_bytes:
+            # Ring full (counted as an overrun): play the oldest audio right here so nothing is lost
+            # and order is kept, then store the rest
+            while self.jitter_buffer.free() < num_bytes - offset and self.play_chunk():
+                pass
+            self.jitter_buffer.write(mv[offset:], num_bytes - offset)
+
     def on_audio_data(self, topic, msg):
-        if topic.decode() == self.mqtt_audio_topic:
-            self.audio_out.write(msg)
-            print("Audio data enqueued")
+        topic = topic.decode()
+        if _TRACE:
+            log.debug("Downlink", topic, len(msg), "bytes")
+        if topic == self.mqtt_audio_topic:
+            if self.speaker_codec is None:
+                return
+            if self.speaker_pcm is None:
+                self.enqueue_audio(msg, len(msg))
+            else:
+                if decoded_size(self.speaker_codec.name, len(msg)) > len(self.speaker_pcm):
+                    self.speaker_pcm = bytearray(decoded_size(self.speaker_codec.name, len(msg)))
+                n = self.speaker_codec.decode(msg, self.speaker_pcm, len(msg))
+                self.enqueue_audio(self.speaker_pcm, n)
+        elif topic == self.mqtt_ctrl_ack_topic:
+            ack = ujson.loads(bytes(msg))
+            if ack.get("event") == "hello_request":
+                self.client.resend_hello()
+                return
+            self.set_codec(ack.get("codec", "pcm"), ack.get("downlink"))
+            self.uplink_header = bool(ack.get("uplink_header"))
@@ -1,6 +1,7 @@
 import os
 from machine import I2S
 from machine import Pin
+from vad import frame_level
 
 
 def file_exists(path):
@@ -280,21 +281,19 @@ def play_audio_from_file(file_path, sample_rate_in_hz=8000, sample_size_in_bits=
         print("Resources cleaned up")
 
 
-def is_silence(samples, threshold=500):
+def is_silence(samples, threshold=500, num_bytes=None):
     """
     判断给定的采样数据是否为静音。
-    根据采样数据的振幅平均值与预设阈值比较来判断。
-    
-    :param samples: 采样数据的memoryview或bytearray。
-    :param threshold: 判断为静音的阈值。
+    根据 16 位采样的平均绝对振幅与预设阈值比较来判断。
+
+    :param samples: 16 位小端 PCM 采样数据的memoryview或bytearray。
+    :param threshold: 判断为静音的阈值（平均绝对振幅，0~32768）。
+    :param num_bytes: 有效数据的字节数，默认为整个缓冲区。
     :return: 如果是静音则返回True，否则返回False。
     """
-    # 将bytearray转换为整数进行振幅判断
-    amplitude_sum = 0
-    for sample in samples:
-        amplitude_sum += abs(sample - 128)  # 假设采样数据为8位，中间值为128
-    average_amplitude = amplitude_sum / len(samples)
-    return average_amplitude < threshold
+    if num_bytes is None:
+        num_bytes = len(samples)
+    return frame_level(samples, num_bytes) < threshold
 
 
 def slice_audio(audio_stream, slice_size=1000):
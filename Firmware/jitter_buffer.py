@@ -0,0 +1,98 @@
+import utime
+
+
+class JitterBuffer:
+    # Fixed-size ring buffer between the MQTT callback (producer) and the playback task (consumer).
+    # All storage is allocated once; reads and writes copy through memoryview slices.
+    def __init__(self, capacity=32000, preroll_bytes=6400, flush_after_ms=300, underrun_window_ms=500):
+        """
+        :param capacity: Ring size in bytes (32000 bytes = 1 s of 16 kHz 16-bit mono).
+        :param preroll_bytes: Bytes to buffer before playback starts or resumes.
+        :param flush_after_ms: Play whatever is buffered once no data has arrived for this long (end of a reply).
+        :param underrun_window_ms: Data arriving this soon after the buffer ran dry counts as an underrun.
+        """
+        self.buffer = bytearray(capacity)
+        self.mv = memoryview(self.buffer)
+        self.capacity = capacity
+        self.preroll_bytes = min(preroll_bytes, capacity)
+        self.flush_after_ms = flush_after_ms
+        self.underrun_window_ms = underrun_window_ms
+        self.read_pos = 0
+        self.write_pos = 0
+        self.count = 0
+        self.playing = False
+        self.last_write = utime.ticks_ms()
+        self.empty_at = None
+        self.underruns = 0
+        self.overruns = 0
+
+    def free(self):
+        return self.capacity - self.count
+
+    def clear(self):
+        self.read_pos = 0
+        self.write_pos = 0
+        self.count = 0
+        self.playing = False
+        self.empty_at = None
+
+    def write(self, data, num_bytes=None):
+        """
+        Copies data into the ring.
+
+        :param data: bytes, bytearray or memoryview.
+        :param num_bytes: Number of valid bytes in `data` (defaults to len(data)).
+        :return: Number of bytes stored; less than num_bytes when the ring is full (counted as an overrun).
+        """
+        if num_bytes is None:
+            num_bytes = len(data)
+        now = utime.ticks_ms()
+        if self.empty_at is not None:
+            if utime.ticks_diff(now, self.empty_at) < self.underrun_window_ms:
+                self.underruns += 1
+            self.empty_at = None
+        self.last_write = now
+        n = min(num_bytes, self.free())
+        if n < num_bytes:
+            self.overruns += 1
+        first = min(n, self.capacity - self.write_pos)
+        self.mv[self.write_pos:self.write_pos + first] = data[:first]
+        if n > first:
+            self.mv[:n - first] = data[first:n]
+        self.write_pos = (self.write_pos + n) % self.capacity
+        self.count += n
+        return n
+
+    def readable(self):
+        """
+        Returns how many bytes playback may consume now, honouring the pre-roll.
+        """
+        if not self.playing:
+            idle = utime.ticks_diff(utime.ticks_ms(), self.last_write)
+            if self.count >= self.preroll_bytes or (self.count and idle >= self.flush_after_ms):
+                self.playing = True
+        return self.count if self.playing else 0
+
+    def readinto(self, out, max_bytes=None):
+        """
+        Moves up to max_bytes (default len(out)) of buffered audio into `out`.
+
+        :return: Number of bytes copied.
+        """
+        if max_bytes is None:
+            max_bytes = len(out)
+        n = min(max_bytes, self.count)
+        first = min(n, self.capacity - self.read_pos)
+        out[:first] = self.mv[self.read_pos:self.read_pos + first]
+        if n > first:
+            out[first:n] = self.mv[:n - first]
+        self.read_pos = (self.read_pos + n) % self.capacity
+        self.count -= n
+        if self.count == 0 and self.playing:
+            # Ran dry: wait for the pre-roll again; the next write tells us whether this was an underrun
+            self.playing = False
+            self.empty_at = utime.ticks_ms()
+        return n
+
+    def stats(self):
+        return {"buffered": self.count, "underruns": self.underruns, "overruns": self.overruns}
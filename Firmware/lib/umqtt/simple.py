@@ -34,6 +34,8 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.recv_buf = None
+        self.recv_mv = None
 
     def _send_str(self, s):
         self.sock.write(struct.pack("!H", len(s)))
@@ -52,6 +54,23 @@ class MQTTClient:
     def set_callback(self, f):
         self.cb = f
 
+    # Receive PUBLISH payloads into a caller-supplied preallocated buffer
+    # instead of allocating a new bytes object per message. The callback
+    # then gets a memoryview into that buffer, valid only until it returns.
+    # Payloads larger than the buffer fall back to an allocated read.
+    def set_recv_buffer(self, buf):
+        self.recv_buf = buf
+        self.recv_mv = memoryview(buf) if buf is not None else None
+
+    def _readinto(self, mv, sz):
+        n = 0
+        while n < sz:
+            r = self.sock.readinto(mv[n:sz])
+            if not r:
+                raise OSError(-1)
+            n += r
+        return mv[:sz]
+
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
         assert topic
@@ -194,7 +213,10 @@ class MQTTClient:
             pid = self.sock.read(2)
             pid = pid[0] << 8 | pid[1]
             sz -= 2
-        msg = self.sock.read(sz)
+        if self.recv_mv is not None and sz <= len(self.recv_buf):
+            msg = self._readinto(self.recv_mv, sz)
+        else:
+            msg = self.sock.read(sz)
         self.cb(topic, msg)
         if op & 6 == 2:
             pkt = bytearray(b"\x40\x02\0\0")
@@ -0,0 +1,62 @@
+try:
+    from micropython import const
+except ImportError:  # CPython, e.g. when testing on the host
+    def const(x):
+        return x
+import utime
+
+# Levels, most severe first. LEVEL is fixed at build time: calls above it return before formatting anything.
+# Per-packet call sites in hot loops are additionally wrapped in a module-level `if _TRACE:` with
+# `_TRACE = const(0)`, which the MicroPython compiler removes entirely.
+ERROR = const(1)
+WARNING = const(2)
+INFO = const(3)
+DEBUG = const(4)
+LEVEL = const(3)
+
+_NAMES = ("", "E", "W", "I", "D")
+_last = {}
+
+
+def error(*args):
+    if ERROR <= LEVEL:
+        print("E", *args)
+
+
+def warning(*args):
+    if WARNING <= LEVEL:
+        print("W", *args)
+
+
+def info(*args):
+    if INFO <= LEVEL:
+        print("I", *args)
+
+
+def debug(*args):
+    if DEBUG <= LEVEL:
+        print("D", *args)
+
+
+def limited(key, interval_ms, level, *args):
+    """
+    Logs at most once per interval_ms for the same key, e.g. an error raised on every loop iteration.
+
+    :param key: Identifies the message; a short constant string.
+    :param interval_ms: Minimum time between two printed messages with this key.
+    :param level: ERROR, WARNING, INFO or DEBUG.
+    :return: True if the message was printed.
+    """
+    if level > LEVEL:
+        return False
+    now = utime.ticks_ms()
+    entry = _last.get(key)
+    if entry is not None and utime.ticks_diff(now, entry[0]) < interval_ms:
+        entry[1] += 1
+        return False
+    if entry is not None and entry[1]:
+        print(_NAMES[level], *args, "(%d suppressed)" % entry[1])
+    else:
+        print(_NAMES[level], *args)
+    _last[key] = [now, 0]
+    return True
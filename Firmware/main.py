@@ -18,6 +18,7 @@ PASSWORD = "YOUR_PASSWORD_HERE"  # The WiFi password
 MQTT_BROKER = "YOUR_MQTT_BROKER_IP_HERE"  # The IP address of the MQTT broker
 MQTT_USER = "YOUR_MQTT_USER_HERE"  # The MQTT username
 MQTT_PASSWORD = "YOUR_MQTT_PASSWORD_HERE"  # The MQTT password
+AUDIO_CODECS = ("adpcm", "ulaw", "pcm")  # Audio codecs offered to the server, most preferred first
 
 
 async def main():
@@ -43,17 +44,21 @@ async def main():
 
         # Initialize audio system
         audio_system = AudioSystem(button_pin=0,
-                                   mqtt_mic_topic="mic",
-                                   mqtt_audio_topic="audio",
+                                   mqtt_mic_topic=mqtt_client.mqtt_mic_topic,
+                                   mqtt_audio_topic=mqtt_client.mqtt_audio_topic,
                                    client=mqtt_client,
                                    sample_rate_in_hz_input=16000,
-                                   sample_rate_in_hz_output=16000)
+                                   sample_rate_in_hz_output=16000,
+                                   mqtt_ctrl_ack_topic=mqtt_client.mqtt_ctrl_ack_topic,
+                                   mqtt_ctrl_topic=mqtt_client.mqtt_ctrl_topic)
 
         mqtt_client.set_callback(audio_system.on_audio_data)
         mqtt_client.connect()
+        mqtt_client.send_hello(AUDIO_CODECS)
 
         await asyncio.gather(
             audio_system.record_audio(),
+            audio_system.playback(),
             mqtt_client.listen(),
             #network_manager.monitor()  # Optional: Monitor network connectivity
         )
@@ -4,6 +4,9 @@ sys.path.insert(0, '/lib')
 from umqtt.robust import MQTTClient
 from machine import Pin, WDT, I2S
 import ubinascii
+import ujson
+import log
+from audio_codec import can_decode
 import machine
 import uasyncio as asyncio
 from i2s_audio import play_audio_from_file
@@ -19,21 +22,30 @@ class MQTTClientWrapper:
                  mqtt_audio_topic,
                  mqtt_mic_topic,
                  mqtt_user,
-                 mqtt_password):
+                 mqtt_password,
+                 mqtt_ctrl_topic="ctrl",
+                 recv_buffer_size=10240):
         self.led_data = Pin(led_data_pin, Pin.OUT)  # Data LED pin
         self.led_mqtt = Pin(led_mqtt_pin, Pin.OUT)  # WiFi LED pin
 
         self.mqtt_broker = mqtt_broker  # MQTT broker address
         self.mqtt_port = mqtt_port  # MQTT broker port
-        self.mqtt_audio_topic = mqtt_audio_topic  # Topic for audio data
-        self.mqtt_mic_topic = mqtt_mic_topic  # Topic for microphone data
         self.mqtt_user = mqtt_user  # MQTT user
         self.mqtt_password = mqtt_password  # MQTT password
         self.client_id = f'esp32_{ubinascii.hexlify(machine.unique_id()).decode()}'  # Unique MQTT client ID
+        # Per-device topics so the server can route each board to its own session
+        self.mqtt_audio_topic = f'{mqtt_audio_topic}/{self.client_id}'  # Topic for audio data
+        self.mqtt_mic_topic = f'{mqtt_mic_topic}/{self.client_id}'  # Topic for microphone data
+        self.mqtt_ctrl_topic = f'{mqtt_ctrl_topic}/{self.client_id}'  # Topic for capability announcements
+        self.mqtt_ctrl_ack_topic = f'{self.mqtt_ctrl_topic}/ack'  # Server's reply with the chosen codec
         self.client = None
-        
+        self.hello = None  # Last capability announcement, sent again when the server asks for it
+
         self.client = MQTTClient(client_id=self.client_id, server=self.mqtt_broker, user=self.mqtt_user,
                                  password=self.mqtt_password, keepalive=60)
+        # Incoming payloads (TTS audio, up to 10000 bytes per message) are read into one preallocated
+        # buffer; callbacks receive a memoryview that is only valid until they return
+        self.client.set_recv_buffer(bytearray(recv_buffer_size))
 
     def connect(self):
         # Connects to the MQTT broker and subscribes to the audio topic
@@ -41,10 +53,11 @@ class MQTTClientWrapper:
 
         self.client.connect(clean_session=True)
         
-        print("Initializing subscriptions")
+        log.debug("Initializing subscriptions")
         self.client.add_subscription(self.mqtt_audio_topic)
+        self.client.add_subscription(self.mqtt_ctrl_ack_topic)
         
-        print("Starting to listen for MQTT messages...")
+        log.info("Starting to listen for MQTT messages...")
 
         # Start led
         self.led_mqtt.value(1)
@@ -52,6 +65,25 @@ class MQTTClientWrapper:
         # Play start sound
         play_audio_from_file(file_path="res/init.wav", sample_rate_in_hz=16000, sample_size_in_bits=16, mono=False)
 
+    def send_hello(self, codecs, downlink_codecs=None, uplink_header=True):
+        # Announce the audio codecs this device supports, in order of preference. downlink_codecs lists
+        # what the speaker side can decode when it differs (e.g. firmware built with an Opus decoder module,
+        # see audio_codec.register_decoder); codecs without a decoder are left out so the server never picks them.
+        # uplink_header asks the server to accept microphone frames prefixed with a sequence number and timestamp
+        hello = {"codecs": list(codecs), "uplink_header": uplink_header}
+        if downlink_codecs:
+            hello["downlink"] = [codec for codec in downlink_codecs if can_decode(codec)]
+            if len(hello["downlink"]) < len(downlink_codecs):
+                log.warning("No decoder for downlink codecs:",
+                            [codec for codec in downlink_codecs if not can_decode(codec)])
+        self.hello = ujson.dumps(hello)
+        self.client.publish(self.mqtt_ctrl_topic, self.hello)
+
+    def resend_hello(self):
+        # The server lost this device's negotiated codec (e.g. it restarted) and asks for the hello again
+        if self.hello:
+            self.client.publish(self.mqtt_ctrl_topic, self.hello)
+
     def publish(self, topic, msg, retain=False, qos=0):
         # Publish a message to a given MQTT topic
         self.client.publish(topic, msg, qos=qos)
@@ -0,0 +1,133 @@
+"""
+Host benchmark for the umqtt receive path (runs under CPython, not on the device).
+
+Runs lib/umqtt/simple.py against a real broker through a small socket shim and
+compares the default wait_msg (one allocated bytes object per PUBLISH) with the
+preallocated receive buffer set via MQTTClient.set_recv_buffer().
+
+    python Firmware/tools/bench_umqtt.py --broker 127.0.0.1 --messages 500 --size 10000
+"""
+import argparse
+import binascii
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+
+class SocketShim:
+    # Gives a CPython socket the MicroPython stream API used by umqtt (read/readinto/write)
+    def __init__(self, *args):
+        self.sock = socket.socket(*args)
+
+    def connect(self, addr):
+        self.sock.connect(addr)
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def read(self, n):
+        # MSG_WAITALL returns the whole payload as one object, like MicroPython's blocking read(n)
+        try:
+            return self.sock.recv(n, socket.MSG_WAITALL if self.sock.getblocking() else 0) or b""
+        except BlockingIOError:
+            return None
+
+    def readinto(self, buf, n=None):
+        try:
+            return self.sock.recv_into(buf, n or len(buf))
+        except BlockingIOError:
+            return None
+
+    def write(self, buf, n=None):
+        if isinstance(buf, str):
+            buf = buf.encode()  # MicroPython streams accept str
+        self.sock.sendall(memoryview(buf)[:n] if n is not None else buf)
+        return n if n is not None else len(buf)
+
+    def close(self):
+        self.sock.close()
+
+
+def install_shims():
+    usocket = types.ModuleType('usocket')
+    usocket.socket = SocketShim
+    usocket.getaddrinfo = socket.getaddrinfo
+    sys.modules['usocket'] = usocket
+    sys.modules['ustruct'] = struct
+    sys.modules['ubinascii'] = binascii
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+
+def publisher(simple, args, topic, ready, done):
+    client = simple.MQTTClient('bench_pub', args.broker, port=args.port)
+    client.connect()
+    ready.wait()
+    payload = bytes(args.size)
+    for _ in range(args.messages):
+        client.publish(topic, payload)
+    # Some brokers discard unprocessed QoS 0 messages when the sender disconnects right away
+    done.wait()
+    client.disconnect()
+
+
+def run(simple, args, recv_buffer):
+    topic = f'bench/{os.getpid()}/{"buffer" if recv_buffer else "alloc"}'.encode()
+    received = []
+
+    def on_message(topic, msg):
+        received.append(len(msg))
+
+    client = simple.MQTTClient('bench_sub', args.broker, port=args.port)
+    client.set_callback(on_message)
+    if recv_buffer:
+        client.set_recv_buffer(bytearray(args.size))
+    client.connect()
+    client.subscribe(topic)
+
+    ready = threading.Event()
+    done = threading.Event()
+    thread = threading.Thread(target=publisher, args=(simple, args, topic, ready, done), daemon=True)
+    thread.start()
+    time.sleep(0.2)
+
+    allocated = 0
+    tracemalloc.start()
+    ready.set()
+    start = time.perf_counter()
+    while len(received) < args.messages:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        client.wait_msg()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    done.set()
+    client.disconnect()
+    thread.join()
+
+    mode = "recv buffer" if recv_buffer else "allocating"
+    print(f"{mode}: {args.messages} x {args.size} B in {elapsed * 1000:.0f} ms, "
+          f"{elapsed / args.messages * 1e6:.0f} us/msg, peak transient allocation {allocated / args.messages:.0f} B/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="umqtt wait_msg allocation benchmark")
+    parser.add_argument('--broker', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--size', type=int, default=10000)
+    args = parser.parse_args()
+
+    install_shims()
+    from umqtt import simple
+    run(simple, args, recv_buffer=False)
+    run(simple, args, recv_buffer=True)
+
+
+if __name__ == "__main__":
+    main()
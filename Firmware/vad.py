@@ -0,0 +1,87 @@
+try:
+    from vad_viper import abs_sum
+except ImportError:  # CPython, or a port without the viper emitter
+    abs_sum = None
+
+
+def abs_sum_reference(buf, num_bytes):
+    """
+    Pure-Python reference for the viper abs_sum: sum of |sample| over 16-bit little-endian samples.
+
+    :param buf: bytes, bytearray or memoryview holding the PCM samples.
+    :param num_bytes: Number of valid bytes in `buf`.
+    :return: Sum of absolute sample values.
+    """
+    total = 0
+    for i in range(0, num_bytes - 1, 2):
+        v = buf[i] | (buf[i + 1] << 8)
+        if v & 0x8000:
+            v = 0x10000 - v
+        total += v
+    return total
+
+
+if abs_sum is None:
+    abs_sum = abs_sum_reference
+
+
+def frame_level(buf, num_bytes):
+    """
+    Returns the mean absolute amplitude (0..32768) of a 16-bit PCM frame.
+    """
+    samples = num_bytes >> 1
+    return abs_sum(buf, num_bytes) // samples if samples else 0
+
+
+class VoiceActivityDetector:
+    # Frame-energy VAD for the record loop. The noise floor follows the level while nobody is
+    # speaking; a frame counts as speech when it is `ratio` times louder than the floor (and above
+    # `min_level`). Speech starts after `start_frames` loud frames in a row and ends after
+    # `hangover_frames` quiet ones. All arithmetic is integer so it is cheap on the ESP32.
+    def __init__(self, min_level=300, ratio=3, start_frames=2, hangover_frames=13):
+        """
+        :param min_level: Minimum mean absolute amplitude treated as speech.
+        :param ratio: How many times louder than the noise floor speech must be.
+        :param start_frames: Consecutive loud frames needed to start speech.
+        :param hangover_frames: Consecutive quiet frames that end speech (13 x ~31 ms = ~400 ms).
+        """
+        self.min_level = min_level
+        self.ratio = ratio
+        self.start_frames = start_frames
+        self.hangover_frames = hangover_frames
+        self.reset()
+
+    def reset(self):
+        self.noise_floor = self.min_level // self.ratio
+        self.in_speech = False
+        self.loud = 0
+        self.quiet = 0
+
+    def process(self, buf, num_bytes):
+        """
+        Classifies one frame.
+
+        :return: (in_speech, ended) where ended is True on the frame that closes an utterance.
+        """
+        level = frame_level(buf, num_bytes)
+        loud = level >= self.min_level and level >= self.noise_floor * self.ratio
+        if not self.in_speech:
+            if loud:
+                self.loud += 1
+                if self.loud >= self.start_frames:
+                    self.in_speech = True
+                    self.quiet = 0
+            else:
+                self.loud = 0
+                # Slow exponential average of the background level (1/16 per frame)
+                self.noise_floor += (level - self.noise_floor) >> 4
+            return self.in_speech, False
+        if loud:
+            self.quiet = 0
+            return True, False
+        self.quiet += 1
+        if self.quiet >= self.hangover_frames:
+            self.in_speech = False
+            self.loud = 0
+            return False, True
+        return True, False
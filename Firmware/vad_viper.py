@@ -0,0 +1,15 @@
+# Viper fast path for vad.py; importing this module fails outside MicroPython
+import micropython
+
+
+@micropython.viper
+def abs_sum(buf, num_bytes: int) -> int:
+    # Sum of |sample| over 16-bit little-endian samples; <= 32768 * samples fits a small int for audio-sized frames
+    p = ptr16(buf)
+    total = 0
+    for i in range(num_bytes >> 1):
+        v = p[i]
+        if v & 0x8000:
+            v = 0x10000 - v
+        total += v
+    return total
@@ -0,0 +1,93 @@
+import time
+
+
+class StreamingChunker:
+    # 把合成器产出的任意大小的 PCM 块切成逐渐变大的数据包：首包很小（默认 100ms），尽快让设备出声；
+    # 估算的设备端缓冲超过 low_water 秒后每包翻倍，直到 max_bytes，减少 MQTT 消息数；
+    # 合成跟不上播放、缓冲低于 low_water 时回落到小包。
+    # 数据存放在预分配的 bytearray 环形缓冲区中，避免 bytes 拼接反复拷贝；包大小按 align 对齐（Opus 20ms 帧）。
+    # max_lead 为设备端最多缓冲的秒数，发送方按 send_delay() 等待，避免设备的抖动缓冲区溢出
+    def __init__(self, first_bytes=3200, max_bytes=32000, low_water=0.3, align=640, bytes_per_second=32000,
+                 max_lead=None):
+        self.first_bytes = first_bytes
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.max_lead = max_lead
+        self.align = align
+        self.bytes_per_second = bytes_per_second
+        self.buffer = bytearray(max_bytes * 2)
+        self.view = memoryview(self.buffer)
+        self.capacity = len(self.buffer)
+        self.read_pos = 0
+        self.count = 0
+        self.next_size = first_bytes
+        self.started = None
+        self.sent_seconds = 0.0
+
+    def start_turn(self):
+        # 新一轮回复：设备端缓冲视为空，重新从小包开始
+        self.clear()
+        self.next_size = self.first_bytes
+        self.started = None
+        self.sent_seconds = 0.0
+
+    def clear(self):
+        self.read_pos = 0
+        self.count = 0
+
+    def push(self, data):
+        # 写入一块 PCM，返回已经攒够的数据包列表（可能为空）
+        packets = []
+        data = memoryview(data)
+        while len(data):
+            n = min(len(data), self.capacity - self.count)
+            write_pos = (self.read_pos + self.count) % self.capacity
+            first = min(n, self.capacity - write_pos)
+            self.view[write_pos:write_pos + first] = data[:first]
+            if n > first:
+                self.view[:n - first] = data[first:n]
+            self.count += n
+            data = data[n:]
+            while self.count >= self.next_size:
+                packets.append(self.take(self.next_size))
+        return packets
+
+    def flush(self):
+        # 片段结束，剩余数据作为最后一个包
+        return [self.take(self.count)] if self.count else []
+
+    def take(self, size):
+        packet = bytearray(size)
+        first = min(size, self.capacity - self.read_pos)
+        packet[:first] = self.view[self.read_pos:self.read_pos + first]
+        if size > first:
+            packet[first:] = self.view[:size - first]
+        self.read_pos = (self.read_pos + size) % self.capacity
+        self.count -= size
+        self.update_size(size)
+        return packet
+
+    def buffered_seconds(self, now=None):
+        # 假设设备收到首包即开始按 1 倍速播放，估算它还缓冲着多少秒音频
+        if self.started is None:
+            return 0.0
+        now = time.perf_counter() if now is None else now
+        return self.sent_seconds - (now - self.started)
+
+    def send_delay(self, now=None):
+        # 已切出的包全部送达后设备缓冲会超过 max_lead 多少秒；先等这么久再发送，相当于按播放速度发送
+        if self.max_lead is None:
+            return 0.0
+        return max(0.0, self.buffered_seconds(now) - self.max_lead)
+
+    def update_size(self, size):
+        now = time.perf_counter()
+        if self.started is None or self.buffered_seconds(now) < 0:
+            # 首包，或设备已经播完此前的音频：从现在重新计时
+            self.started = now
+            self.sent_seconds = 0.0
+        self.sent_seconds += size / self.bytes_per_second
+        if self.buffered_seconds(now) < self.low_water:
+            self.next_size = self.first_bytes
+        else:
+            self.next_size = max(self.first_bytes, min(self.next_size * 2, self.max_bytes) // self.align * self.align)
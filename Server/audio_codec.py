@@ -0,0 +1,220 @@
+import numpy as np
+
+# 与固件 Firmware/audio_codec.py 相同的编码格式，服务端用 NumPy 实现
+
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+], dtype=np.int32)
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int32)
+
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+
+
+def ulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = ((mantissa << 3) + ULAW_BIAS << exponent) - ULAW_BIAS
+    return np.where(codes & 0x80, -magnitude, magnitude).astype('<i2')
+
+
+ULAW_DECODE = ulaw_decode_table()
+
+
+class PCMCodec:
+    # 不压缩，兼容未协商编码的旧固件
+    name = 'pcm'
+    ratio = 1
+
+    def encode(self, pcm):
+        return bytes(pcm)
+
+    def decode(self, data):
+        return bytes(data)
+
+
+class ULawCodec:
+    # G.711 µ-law：每个 16 位采样压成 1 字节（2:1），无状态，MQTT 分片不影响解码
+    name = 'ulaw'
+    ratio = 2
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2).astype(np.int32)
+        sign = np.where(samples < 0, 0x80, 0)
+        magnitude = np.minimum(np.abs(samples), ULAW_CLIP) + ULAW_BIAS
+        # 指数为 magnitude 最高有效位相对第 7 位的位置
+        exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+        mantissa = (magnitude >> (exponent + 3)) & 0x0F
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+    def decode(self, data):
+        return ULAW_DECODE[np.frombuffer(data, dtype=np.uint8)].tobytes()
+
+
+class ImaAdpcmCodec:
+    # IMA-ADPCM：每个采样 4 位（约 4:1）。每个数据包自带 4 字节头（预测值 int16、步长索引、保留字节），
+    # 接着是每字节两个采样的编码（先低 4 位），包之间互不依赖，丢包或打断后不会影响后续解码。
+    # 预测值逐采样递推无法整体向量化：编码逐采样循环，解码先循环算出步长索引，其余用 NumPy 批量完成
+    name = 'adpcm'
+    ratio = 4
+    HEADER_SIZE = 4
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+        self.steps = STEP_TABLE.tolist()
+        self.index_adjust = INDEX_TABLE.tolist()
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2).tolist()
+        header = np.array([self.predictor], dtype='<i2').tobytes() + bytes((self.index, 0))
+        codes = bytearray(len(samples) + (len(samples) & 1))
+        predictor, index = self.predictor, self.index
+        steps, index_adjust = self.steps, self.index_adjust
+        for i, sample in enumerate(samples):
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+            predictor = predictor - delta if code & 8 else predictor + delta
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index += index_adjust[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            codes[i] = code
+        self.predictor, self.index = predictor, index
+        packed = np.frombuffer(bytes(codes), dtype=np.uint8)
+        return header + (packed[0::2] | (packed[1::2] << 4)).tobytes()
+
+    def decode(self, data):
+        if len(data) <= self.HEADER_SIZE:
+            return b""
+        predictor = int(np.frombuffer(data[:2], dtype='<i2')[0])
+        index = min(max(data[2], 0), 88)
+        packed = np.frombuffer(data[self.HEADER_SIZE:], dtype=np.uint8)
+        codes = np.empty(len(packed) * 2, dtype=np.int32)
+        codes[0::2] = packed & 0x0F
+        codes[1::2] = packed >> 4
+
+        indices = np.empty(len(codes), dtype=np.int32)
+        index_adjust = self.index_adjust
+        for i, code in enumerate(codes.tolist()):
+            indices[i] = index
+            index += index_adjust[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+
+        step = STEP_TABLE[indices]
+        delta = (step >> 3) + np.where(codes & 4, step, 0) + np.where(codes & 2, step >> 1, 0) \
+            + np.where(codes & 1, step >> 2, 0)
+        delta = np.where(codes & 8, -delta, delta)
+        samples = predictor + np.cumsum(delta)
+        if samples.max(initial=0) > 32767 or samples.min(initial=0) < -32768:
+            # 罕见的削波情况下预测值会被截断，需要逐采样重算
+            samples = self.clamped_sum(predictor, delta.tolist())
+        return samples.astype('<i2').tobytes()
+
+    @staticmethod
+    def clamped_sum(predictor, deltas):
+        samples = np.empty(len(deltas), dtype=np.int32)
+        for i, delta in enumerate(deltas):
+            predictor = min(max(predictor + delta, -32768), 32767)
+            samples[i] = predictor
+        return samples
+
+
+class OpusCodec:
+    # 仅用于下行：在服务端把任意 TTS 后端输出的 PCM 编码成 Opus（20ms 帧），与合成引擎无关。
+    # 一条 MQTT 消息装入若干帧，每帧前加 2 字节小端长度，设备按长度逐帧解码；编码器状态跨消息保持
+    name = 'opus'
+    FRAME_SAMPLES = 320  # 16kHz 下 20ms
+    FRAME_BYTES = FRAME_SAMPLES * 2
+
+    def __init__(self, sample_rate=16000, bitrate=24000):
+        try:
+            import opuslib
+        except Exception:  # 未安装 opuslib 或找不到 libopus 时 opuslib 抛出的不是 ImportError
+            raise ImportError("OpusCodec requires the 'opuslib' package and libopus: pip install opuslib")
+        self.encoder = opuslib.Encoder(sample_rate, 1, 'voip')
+        self.encoder.bitrate = bitrate
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+        self.ratio = 256000 / bitrate
+
+    def encode(self, pcm):
+        packets = []
+        for start in range(0, len(pcm), self.FRAME_BYTES):
+            frame = pcm[start:start + self.FRAME_BYTES]
+            if len(frame) < self.FRAME_BYTES:
+                frame = bytes(frame) + bytes(self.FRAME_BYTES - len(frame))  # 最后不足一帧补静音
+            packet = self.encoder.encode(bytes(frame), self.FRAME_SAMPLES)
+            packets.append(len(packet).to_bytes(2, 'little'))
+            packets.append(packet)
+        return b"".join(packets)
+
+    def decode(self, data):
+        pcm = []
+        pos = 0
+        while pos + 2 <= len(data):
+            size = int.from_bytes(data[pos:pos + 2], 'little')
+            pcm.append(self.decoder.decode(bytes(data[pos + 2:pos + 2 + size]), self.FRAME_SAMPLES))
+            pos += 2 + size
+        return b"".join(pcm)
+
+
+CODECS = {
+    'opus': OpusCodec,
+    'adpcm': ImaAdpcmCodec,
+    'ulaw': ULawCodec,
+    'pcm': PCMCodec,
+}
+
+
+UPLINK_CODECS = ('adpcm', 'ulaw', 'pcm')  # 设备端可以实时编码的格式
+
+
+def create_codec(name):
+    return CODECS.get(name, PCMCodec)()
+
+
+def codec_available(name):
+    try:
+        create_codec(name)
+    except ImportError:
+        return False
+    return name in CODECS
+
+
+def negotiate_codec(offered, enabled, allowed=None):
+    # 按设备给出的偏好顺序选择第一个服务端也启用（且本机可用）的编码，都不支持时回退到 pcm
+    for name in offered or ():
+        if name in enabled and (allowed is None or name in allowed) and codec_available(name):
+            return name
+    return 'pcm'
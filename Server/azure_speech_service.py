@@ -1,180 +1,376 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
 import azure.cognitiveservices.speech as speechsdk
 from azure.cognitiveservices.speech.audio import AudioStreamFormat, PushAudioInputStream
-import time
-import threading
-from queue import Queue
-
-
-class AzureSpeechService:
-    def __init__(self, speech_key, service_region, mqtt_audio_topic, robot_topic, recognition_language,
-                 synthesis_voice_name, output_format, data_queue):
-        self.speech_key = speech_key
-        self.service_region = service_region
-        self.mqtt_audio_topic = mqtt_audio_topic
-        self.mqtt_robot_topic = robot_topic
-        self.speech_config = self.create_speech_config(recognition_language, synthesis_voice_name, output_format)
-        self.data_queue = data_queue
-        self.speech_recognizer = None
-        self.push_stream = None
-        self.audio_config = None
-        self.recognized_callback = None
-        self.last_audio_time = None
-        self.speech_timeout = 2.0  # 2秒没有新的音频输入就认为说话结束并停止识别
-        self.timeout_timer = None
-        self.is_recognizing = False
-        self.synthesizer = self.setup_synthesizer()
-        self.tts_queue = Queue()
-        self.tts_thread = threading.Thread(target=self.tts_worker, daemon=True)
-        self.tts_thread.start()
-        self.tts_buffer = b""
-        self.tts_buffer_size = 32000  # 大约2秒的音频数据 (16kHz, 16-bit)
-        self.tts_buffer_lock = threading.Lock()
-
-    def create_speech_config(self, recognition_language, synthesis_voice_name, output_format):
-        speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.service_region)
+
+from stt_backend import STTBackend
+from tts_backend import TTSBackend
+
+logger = logging.getLogger(__name__)
+
+
+def create_speech_config(speech_key, service_region, recognition_language=None, synthesis_voice_name=None,
+                         output_format=None):
+    speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
+    if recognition_language:
         speech_config.speech_recognition_language = recognition_language
+    if synthesis_voice_name:
         speech_config.speech_synthesis_voice_name = synthesis_voice_name
+    if output_format is not None:
         speech_config.set_speech_synthesis_output_format(output_format)
-        return speech_config
+    return speech_config
 
-    def setup_recognizer(self, callback):
-        self.recognized_callback = callback
-        self.reset_recognizer()
 
-    def reset_recognizer(self):
+class RecognizerSession:
+    # 一次识别所需的全部 SDK 对象：推流、AudioConfig、SpeechRecognizer 和回调都已建好，并预先打开到服务端的连接。
+    # SDK 回调运行在 SDK 线程中，通过 call_soon_threadsafe 转回事件循环后交给当前使用它的后端（owner）
+    def __init__(self, speech_config, loop, partial_results=False):
+        self.loop = loop
+        self.owner = None
+        self.created = time.monotonic()
+        self.started = False
+        self.closed = False
+        self.broken = False  # 连接失败或识别被取消，不能再用
+        self.has_result = False  # 已收到过最终结果（包括 NoMatch）
         audio_format = AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1)
-        print(f"Setting up audio stream with format: {audio_format}")
         self.push_stream = PushAudioInputStream(audio_format)
         self.audio_config = speechsdk.audio.AudioConfig(stream=self.push_stream)
-        self.speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config,
-                                                            audio_config=self.audio_config)
+        self.recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=self.audio_config)
+        # 中间结果每秒多次，只在需要（投机请求）或调试时订阅，避免 SDK 线程为每个事件回调 Python
+        if partial_results:
+            self.recognizer.recognizing.connect(self.handle_partial_result)
+        elif logger.isEnabledFor(logging.DEBUG):
+            self.recognizer.recognizing.connect(lambda evt: logger.debug("RECOGNIZING: %s", evt.result.text))
+        if logger.isEnabledFor(logging.DEBUG):
+            self.recognizer.session_started.connect(lambda evt: logger.debug("SESSION STARTED: %s", evt))
+        self.recognizer.recognized.connect(self.handle_final_result)
+        self.recognizer.session_stopped.connect(self.handle_session_stopped)
+        self.recognizer.canceled.connect(self.handle_canceled)
+        # 预先建立连接，第一块音频到达时不必再等握手
+        self.connection = speechsdk.Connection.from_recognizer(self.recognizer)
+        self.connection.open(True)
 
-        self.speech_recognizer.recognizing.connect(lambda evt: print('RECOGNIZING: {}'.format(evt)))
-        self.speech_recognizer.recognized.connect(self.handle_final_result)
-        self.speech_recognizer.session_started.connect(lambda evt: print('SESSION STARTED: {}'.format(evt)))
-        self.speech_recognizer.session_stopped.connect(lambda evt: print('SESSION STOPPED {}'.format(evt)))
-        self.speech_recognizer.canceled.connect(self.on_canceled)
+    def handle_partial_result(self, evt):
+        self.loop.call_soon_threadsafe(self.deliver, 'on_partial_result', evt.result.text)
 
-    def start_timeout_timer(self):
-        if self.timeout_timer:
-            self.timeout_timer.cancel()
-        self.timeout_timer = threading.Timer(self.speech_timeout, self.stop_recognition)
-        self.timeout_timer.start()
+    def handle_final_result(self, evt):
+        self.loop.call_soon_threadsafe(self.deliver, 'on_final_result', evt.result.reason, evt.result.text)
 
-    def process_audio_chunk(self, audio_chunk):
-        if self.push_stream:
-            try:
-                self.push_stream.write(audio_chunk)
-                self.last_audio_time = time.time()
-                print(f"Successfully wrote {len(audio_chunk)} bytes to the push stream")
+    def handle_session_stopped(self, evt):
+        logger.debug("SESSION STOPPED: %s", evt)
+        self.loop.call_soon_threadsafe(self.deliver, 'on_session_stopped')
 
-                if not self.is_recognizing:
-                    self.start_continuous_recognition()
+    def handle_canceled(self, evt):
+        self.broken = True
+        cancellation_details = evt.cancellation_details
+        if cancellation_details.reason == speechsdk.CancellationReason.Error:
+            logger.error("Recognition canceled: %s", cancellation_details.error_details)
+        else:
+            logger.info("Recognition canceled: %s", cancellation_details.reason)
+        self.loop.call_soon_threadsafe(self.deliver, 'on_recognition_canceled')
+
+    def deliver(self, method, *args):
+        if self.owner is not None and not self.closed:
+            getattr(self.owner, method)(self, *args)
+
+    def start(self):
+        self.started = True
+        # 使用异步接口，不阻塞事件循环
+        self.recognizer.start_continuous_recognition_async()
+
+    def stop(self):
+        if self.started:
+            self.started = False
+            self.recognizer.stop_continuous_recognition_async()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.owner = None
+        self.stop()
+        self.push_stream.close()
+        self.connection.close()
+
+
+class RecognizerPoolStats:
+    # 所有识别池共用的计数：命中预热会话、临时新建（未命中）、因闲置过期或连接失败丢弃，以及预热次数和累计耗时
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.warmups = 0
+        self.warmup_seconds = 0.0
 
-                self.start_timeout_timer()  # 重置超时定时器
-            except Exception as e:
-                print(f"Error writing to push stream: {e}")
-                self.reset_recognizer()  # 错误发生时重置识别器
+    def snapshot(self):
+        return {
+            'recognizer_pool_hits': self.hits,
+            'recognizer_pool_misses': self.misses,
+            'recognizer_pool_discarded': self.discarded,
+            'recognizer_warmups': self.warmups,
+            'recognizer_warmup_seconds': round(self.warmup_seconds, 6),
+        }
+
+
+class RecognizerPool:
+    # 同一配置的所有识别后端（设备会话）共用一个池，保持 size 个预热好的会话，由后台任务在线程池中补充，
+    # 建对象和建连接都不在下一句话的关键路径上；闲置设备不再各自占着一条连接。
+    # 闲置超过 max_idle 秒的会话连接可能已被服务端关闭，后台任务到期前就换成新的；取用时仍会丢弃过期和预连接失败的会话
+    def __init__(self, speech_config, loop, size=1, max_idle=60.0, stats=None, partial_results=False):
+        self.speech_config = speech_config
+        self.loop = loop
+        self.partial_results = partial_results
+        self.size = size
+        self.max_idle = max_idle
+        self.refresh_margin = min(5.0, max_idle / 4)  # 提前这么久替换，取用时不会刚好过期
+        self.stats = stats or RecognizerPoolStats()
+        self.warm = deque()
+        self.wakeup = asyncio.Event()
+        self.maintain_task = None
+        self.closed = False
+
+    def create_session(self):
+        start = time.perf_counter()
+        session = RecognizerSession(self.speech_config, self.loop, partial_results=self.partial_results)
+        return session, time.perf_counter() - start
+
+    def record_warmup(self, elapsed):
+        self.stats.warmups += 1
+        self.stats.warmup_seconds += elapsed
+
+    def stale(self, session, now):
+        return session.broken or now - session.created > self.max_idle - self.refresh_margin
+
+    def acquire(self):
+        session = None
+        now = time.monotonic()
+        while self.warm and session is None:
+            session = self.warm.popleft()
+            if session.broken or now - session.created > self.max_idle:
+                self.stats.discarded += 1
+                session.close()
+                session = None
+        if session is not None:
+            self.stats.hits += 1
         else:
-            print("Push stream is not initialized")
-            self.reset_recognizer()
+            self.stats.misses += 1
+            session, elapsed = self.create_session()
+            self.record_warmup(elapsed)
+        self.schedule_refill()
+        return session
 
-    def start_continuous_recognition(self):
-        if not self.speech_recognizer:
-            print("Error: Speech recognizer is not set up. Resetting recognizer...")
-            self.reset_recognizer()
+    def schedule_refill(self):
+        if self.closed:
+            return
+        if self.maintain_task is None or self.maintain_task.done():
+            self.maintain_task = self.loop.create_task(self.maintain())
+        self.wakeup.set()
 
-        if not self.is_recognizing:
-            print("Starting continuous recognition...")
-            self.is_recognizing = True
-            self.speech_recognizer.start_continuous_recognition()
+    async def maintain(self):
+        # 补足预热会话，并在最老的会话快要过期时替换它
+        while not self.closed:
+            self.wakeup.clear()
+            now = time.monotonic()
+            for session in [session for session in self.warm if self.stale(session, now)]:
+                self.warm.remove(session)
+                self.stats.discarded += 1
+                session.close()
+            while not self.closed and len(self.warm) < self.size:
+                try:
+                    session, elapsed = await self.loop.run_in_executor(None, self.create_session)
+                except Exception as e:
+                    logger.error("Error warming up recognizer: %s", e)
+                    break
+                if self.closed:
+                    session.close()
+                    return
+                self.record_warmup(elapsed)
+                self.warm.append(session)
+            oldest = min((session.created for session in self.warm), default=None)
+            timeout = self.max_idle if oldest is None else oldest + self.max_idle - self.refresh_margin - time.monotonic()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(timeout, self.refresh_margin))
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        self.closed = True
+        if self.maintain_task:
+            self.maintain_task.cancel()
+        while self.warm:
+            self.warm.popleft().close()
+
+
+class AzureSTTBackend(STTBackend):
+    # 每句话的第一块音频到达时从识别池取一个预热好的会话。说完后会话停止识别，留在 finishing 中等待最终结果和
+    # session_stopped 后关闭；两句话之间不占用会话，池中的会话由后台任务保持新鲜，不再在关键路径上重建 SpeechRecognizer。
+    # 识别池按配置在进程内共享，第一个使用该配置的后端决定池的大小
+    pools = {}
+
+    def __init__(self, speech_key, service_region, recognition_language, loop=None, speech_timeout=2.0,
+                 pool_size=1, pool_stats=None, partial_results=False):
+        super().__init__(loop=loop, speech_timeout=speech_timeout)
+        key = (speech_key, service_region, recognition_language, partial_results)
+        if key not in self.pools or self.pools[key].closed:
+            speech_config = create_speech_config(speech_key, service_region, recognition_language=recognition_language)
+            self.pools[key] = RecognizerPool(speech_config, self.loop, size=pool_size, stats=pool_stats,
+                                             partial_results=partial_results)
+        self.pool = self.pools[key]
+        self.session = None
+        self.finishing = set()
+        self.last_audio_time = None
+
+    def reset_recognizer(self):
+        # 丢弃当前会话，下一块音频到达时再取新的；同时让识别池开始预热
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.pool.schedule_refill()
+
+    def acquire_session(self):
+        self.session = self.pool.acquire()
+        self.session.owner = self
+
+    def process_audio_chunk(self, audio_chunk):
+        if self.session is None:
+            self.acquire_session()
+        try:
+            self.session.push_stream.write(audio_chunk)
+            self.last_audio_time = self.loop.time()
+            logger.debug("Wrote %d bytes to the push stream", len(audio_chunk))
+
+            if not self.is_recognizing:
+                self.start_continuous_recognition()
+
+            self.start_timeout_timer()  # 重置超时定时器
+        except Exception as e:
+            logger.error("Error writing to push stream: %s", e)
+            self.is_recognizing = False
+            self.reset_recognizer()  # 错误发生时换用新的会话
+
+    def start_continuous_recognition(self):
+        logger.debug("Starting continuous recognition")
+        self.is_recognizing = True
+        self.session.start()
 
     def stop_recognition(self):
-        if self.speech_recognizer and self.is_recognizing:
-            print("Stopping recognition...")
-            self.speech_recognizer.stop_continuous_recognition()
+        if self.session is not None and self.is_recognizing:
+            logger.debug("Stopping recognition")
             self.is_recognizing = False
-        if self.timeout_timer:
-            self.timeout_timer.cancel()
-        print("Recognition stopped")
+            self.session.stop()
+            self.finishing.add(self.session)
+            self.session = None
+        self.cancel_timeout_timer()
 
-    def handle_final_result(self, evt):
-        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            print(f"FINAL RESULT: {evt.result.text}")
-            if self.recognized_callback:
-                self.recognized_callback(evt.result.text)
-        elif evt.result.reason == speechsdk.ResultReason.NoMatch:
-            print("No speech could be recognized")
-
-        # 识别结果处理完后，重置状态以准备下一次识别
-        self.is_recognizing = False
-        if self.timeout_timer:
-            self.timeout_timer.cancel()
-        self.reset_recognizer()  # 每次识别结束后重置识别器
+    def on_partial_result(self, session, text):
+        if session is self.session:
+            self.emit_partial(text)
 
-    def on_canceled(self, evt):
-        print(f"CANCELED: {evt}")
-        cancellation_details = evt.cancellation_details
-        print(f"CANCELED: Reason={cancellation_details.reason}")
-        if cancellation_details.reason == speechsdk.CancellationReason.Error:
-            print(f"CANCELED: ErrorDetails={cancellation_details.error_details}")
+    def on_final_result(self, session, reason, text):
+        session.has_result = True
+        if reason == speechsdk.ResultReason.RecognizedSpeech:
+            logger.info("Final result: %s", text)
+            self.emit_final(text)
+        elif reason == speechsdk.ResultReason.NoMatch:
+            logger.info("No speech could be recognized")
+            self.emit_final("")
+        if session is self.session:
+            # 连续识别中服务端判定一句话结束：与说话结束同样处理
+            self.stop_recognition()
+
+    def on_session_stopped(self, session):
+        if session in self.finishing:
+            self.finishing.discard(session)
+            session.close()
+
+    def on_recognition_canceled(self, session):
+        if session is self.session or (session in self.finishing and not session.has_result):
+            self.emit_final("")  # 这句话不会再有结果
+        self.finishing.discard(session)
+        session.close()
+        if session is self.session:
+            # 下一块音频到达时再换用新的会话；服务不可用时不会在这里反复新建会话
+            self.is_recognizing = False
+            self.cancel_timeout_timer()
+            self.session = None
 
+    def close(self):
+        self.cancel_timeout_timer()
         self.is_recognizing = False
-        if self.timeout_timer:
-            self.timeout_timer.cancel()
-        self.reset_recognizer()  # 取消事件发生时重置识别器
+        for session in list(self.finishing) + [self.session]:
+            if session is not None:
+                session.close()
+        self.finishing.clear()
+        self.session = None
+        self.recognized_callback = None
+
+    @classmethod
+    def close_pools(cls):
+        for pool in cls.pools.values():
+            pool.close()
+        cls.pools.clear()
+
+
+class AzureTTSBackend(TTSBackend):
+    # Azure SDK 的回调运行在 SDK 自己的线程中，合成的音频块通过 call_soon_threadsafe 转回事件循环
+    def __init__(self, speech_key, service_region, synthesis_voice_name, output_format, loop=None):
+        self.speech_config = create_speech_config(speech_key, service_region,
+                                                  synthesis_voice_name=synthesis_voice_name,
+                                                  output_format=output_format)
+        self.loop = loop or asyncio.get_running_loop()
+        self.synthesizer = self.setup_synthesizer()
+        self.synthesis_chunks = asyncio.Queue()
+        self.lock = asyncio.Lock()  # 一个合成器同一时间只合成一段文本
 
     def setup_synthesizer(self):
-        print("Setting up synthesizer")
-        stream = speechsdk.audio.PullAudioOutputStream()
-        audio_config = speechsdk.audio.AudioOutputConfig(stream=stream)
-        synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.speech_config, audio_config=audio_config)
+        # audio_config=None：音频只通过 synthesizing 事件取出，不再写入无人读取的输出流
+        synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.speech_config, audio_config=None)
         synthesizer.synthesizing.connect(self.synthesis_callback)
         synthesizer.synthesis_completed.connect(self.on_synthesis_completed)
-        print("Synthesizer setup complete")
+        synthesizer.synthesis_canceled.connect(self.on_synthesis_canceled)
+        logger.debug("Synthesizer setup complete")
         return synthesizer
 
     def synthesis_callback(self, evt):
         if evt.result.reason == speechsdk.ResultReason.SynthesizingAudio:
             audio_data = evt.result.audio_data
             if audio_data:
-                with self.tts_buffer_lock:
-                    self.tts_buffer += audio_data
-                    if len(self.tts_buffer) >= self.tts_buffer_size:
-                        print(f"Sending {len(self.tts_buffer)} bytes of audio data to MQTT queue")
-                        self.data_queue.put((self.mqtt_audio_topic, self.tts_buffer))
-                        self.tts_buffer = b""
+                self.loop.call_soon_threadsafe(self.synthesis_chunks.put_nowait, audio_data)
             else:
-                print("No audio data received in synthesis event")
+                logger.warning("No audio data received in synthesis event")
 
     def on_synthesis_completed(self, evt):
-        with self.tts_buffer_lock:
-            if self.tts_buffer:
-                print(
-                    f"Synthesis completed. Sending remaining {len(self.tts_buffer)} bytes of audio data to MQTT queue")
-                self.data_queue.put((self.mqtt_audio_topic, self.tts_buffer))
-                self.tts_buffer = b""
-
-    def text_to_speech(self, text):
-        print(f"Queueing text for synthesis: {text}")
-        self.tts_queue.put(text)
-
-    def tts_worker(self):
-        while True:
-            text = self.tts_queue.get()
-            print(f"Processing text-to-speech for: {text}")
+        logger.debug("Synthesis completed")
+        self.loop.call_soon_threadsafe(self.synthesis_chunks.put_nowait, None)
+
+    def on_synthesis_canceled(self, evt):
+        logger.error("Synthesis failed: %s", evt.result.cancellation_details)
+        self.loop.call_soon_threadsafe(self.synthesis_chunks.put_nowait, None)
 
+    async def synthesize(self, text):
+        async with self.lock:
+            # speak_text_async 立即返回，音频块经 synthesis_chunks 送回，None 表示本段合成结束
+            self.synthesizer.speak_text_async(text)
+            finished = False
             try:
-                result = self.synthesizer.speak_text_async(text).get()
-                if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                    print("Synthesis completed successfully")
-                else:
-                    print(f"Synthesis failed: {result.reason}")
-            except Exception as e:
-                print(f"An error occurred during synthesis: {e}")
-
-            self.tts_queue.task_done()
-
-    def robot_cmd(self, cmd):
-        print(f"发送命令到机器人: {cmd} {self.mqtt_robot_topic}")
-        self.data_queue.put((self.mqtt_robot_topic, cmd))
\ No newline at end of file
+                while True:
+                    audio_data = await self.synthesis_chunks.get()
+                    if audio_data is None:
+                        finished = True
+                        break
+                    yield audio_data
+            finally:
+                if not finished:
+                    await self.stop_speaking()
+
+    async def stop_speaking(self):
+        # 调用方提前关闭生成器（用户打断）：停止合成，并丢弃剩余音频块直到结束标记，保证下一段不会收到旧数据
+        self.synthesizer.stop_speaking_async()
+        try:
+            while await asyncio.wait_for(self.synthesis_chunks.get(), timeout=2.0) is not None:
+                pass
+        except asyncio.TimeoutError:
+            self.synthesis_chunks = asyncio.Queue()
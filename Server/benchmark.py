@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import os
+import time
+import wave
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def read_wav_pcm(path):
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1 or wav.getframerate() != 16000:
+            raise ValueError(f"{path} must be 16 kHz, 16-bit, mono PCM")
+        return wav.readframes(wav.getnframes())
+
+
+def create_stt_backend(name, args):
+    if name == 'vosk':
+        from stt_backend import VoskSTTBackend
+        return VoskSTTBackend(model_path=args.vosk_model or os.getenv('VOSK_MODEL_PATH'))
+    if name == 'azure':
+        from azure_speech_service import AzureSTTBackend
+        return AzureSTTBackend(speech_key=os.getenv('SPEECH_KEY'), service_region=os.getenv('SERVICE_REGION'),
+                               recognition_language=os.getenv('RECOGNITION_LANGUAGE'))
+    from stt_backend import StubSTTBackend
+    return StubSTTBackend(["stub transcript"])
+
+
+def create_tts_backend(name, args):
+    if name == 'command':
+        from tts_backend import CommandTTSBackend
+        return CommandTTSBackend(args.command or os.getenv('TTS_COMMAND'))
+    if name == 'azure':
+        import azure.cognitiveservices.speech as speechsdk
+        from azure_speech_service import AzureTTSBackend
+        return AzureTTSBackend(speech_key=os.getenv('SPEECH_KEY'), service_region=os.getenv('SERVICE_REGION'),
+                               synthesis_voice_name=os.getenv('SYNTHESIS_VOICE_NAME'),
+                               output_format=speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm)
+    from tts_backend import ToneTTSBackend
+    return ToneTTSBackend(realtime_factor=args.realtime_factor, latency=getattr(args, 'latency', 0.0))
+
+
+async def bench_tts(args):
+    # 统计每段文本的首字节时间（TTFB）、总合成时间和生成音频时长
+    backend = create_tts_backend(args.backend, args)
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        first_byte = None
+        total_bytes = 0
+        async for chunk in backend.synthesize(args.text):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            total_bytes += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{args.backend}: ttfb={(first_byte or 0) * 1000:.1f} ms total={elapsed * 1000:.1f} ms "
+              f"audio={total_bytes / 32000:.2f}s")
+    backend.close()
+
+
+async def bench_reply(args):
+    # 一段多句回复经 TTSService 合成到发布队列的总耗时与合成并发数的关系。按 1 倍速模拟设备播放：
+    # 收到第一个音频包 preroll 秒后开始播放，某个包晚于它的播放时刻到达就记为卡顿，reply 为设备播完整段回复的时间；
+    # peak buffer 为设备端待播音频的峰值，超过 device_buffer（固件抖动缓冲区）的包记为溢出
+    from tts_service import TTSService
+    segments = [s + "。" for s in args.text.split("。") if s.strip()]
+    for concurrency in (int(n) for n in args.concurrency.split(',')):
+        for _ in range(args.repeat):
+            data_queue = asyncio.Queue()
+            service = TTSService(create_tts_backend(args.backend, args), 'audio', 'robot', data_queue,
+                                 concurrency=concurrency, backend_factory=lambda: create_tts_backend(args.backend, args),
+                                 max_lead=args.max_lead or None)
+            worker = asyncio.create_task(service.tts_worker())
+            arrivals = []
+
+            async def consume():
+                while True:
+                    _, data, _ = await data_queue.get()
+                    arrivals.append((time.perf_counter(), len(data)))
+
+            consumer = asyncio.create_task(consume())
+            start = time.perf_counter()
+            for segment in segments:
+                await service.text_to_speech(segment)
+            while service.busy() or not data_queue.empty():
+                await asyncio.sleep(0.005)
+            worker.cancel()
+            consumer.cancel()
+            service.close()
+
+            playhead, stalls = arrivals[0][0] + args.preroll, 0.0
+            peak, overruns = 0.0, 0
+            for arrived, size in arrivals:
+                if arrived > playhead:
+                    stalls += arrived - playhead
+                    playhead = arrived
+                playhead += size / 32000
+                buffered = playhead - max(arrived, arrivals[0][0] + args.preroll)
+                peak = max(peak, buffered)
+                overruns += buffered > args.device_buffer
+            print(f"concurrency {concurrency}: {len(segments)} segments, first audio {(arrivals[0][0] - start) * 1000:.0f} ms, "
+                  f"all audio {(arrivals[-1][0] - start) * 1000:.0f} ms, reply {(playhead - start) * 1000:.0f} ms, "
+                  f"playback stalls {stalls * 1000:.0f} ms, {len(arrivals)} packets, "
+                  f"peak buffer {peak * 1000:.0f} ms, {overruns} overruns")
+
+
+async def bench_vad(args):
+    # 统计 VAD 每帧（20ms）处理耗时，按 MQTT 上行的块大小送入
+    from vad import VoiceActivityDetector
+    pcm = read_wav_pcm(args.wav)
+    vad = VoiceActivityDetector(hangover_ms=args.hangover_ms)
+    frames = len(pcm) // vad.frame_bytes
+    for _ in range(args.repeat):
+        vad.reset()
+        ends = 0
+        start = time.perf_counter()
+        for offset in range(0, len(pcm), args.chunk):
+            ends += vad.process(pcm[offset:offset + args.chunk])[1]
+        elapsed = time.perf_counter() - start
+        print(f"vad: {frames} frames in {elapsed * 1000:.1f} ms -> {elapsed / frames * 1e6:.2f} us/frame, "
+              f"{ends} utterance ends")
+
+
+async def bench_codec(args):
+    # 每种编码的压缩后码率、编解码 CPU 时间和信噪比；--chunk 对应一条 MQTT 消息的 PCM 字节数。
+    # Opus 是感知编码，SNR 不能反映听感，主要对比 CPU 开销和节省的字节数
+    import numpy as np
+    from audio_codec import codec_available, create_codec
+    pcm = read_wav_pcm(args.wav)
+    audio_seconds = len(pcm) / 32000
+    chunks = [pcm[offset:offset + args.chunk] for offset in range(0, len(pcm), args.chunk)]
+    reference = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+    for name in args.codecs.split(','):
+        if not codec_available(name):
+            print(f"{name}: not available (missing optional dependency)")
+            continue
+        codec = create_codec(name)
+        start = time.process_time()
+        encoded = [codec.encode(chunk) for chunk in chunks]
+        encode_cpu = time.process_time() - start
+        start = time.process_time()
+        decoded = b"".join(codec.decode(packet) for packet in encoded)
+        decode_cpu = time.process_time() - start
+        size = sum(len(packet) for packet in encoded)
+        restored = np.frombuffer(decoded, dtype='<i2')[:len(reference)].astype(np.float64)
+        noise = np.mean((reference - restored) ** 2)
+        snr = 10 * np.log10(np.mean(reference ** 2) / noise) if noise else float('inf')
+        print(f"{codec.name}: {size} bytes ({size * 8 / audio_seconds / 1000:.0f} kbit/s, "
+              f"{len(pcm) / size:.1f}:1), encode {encode_cpu / audio_seconds * 1000:.1f} ms/s, "
+              f"decode {decode_cpu / audio_seconds * 1000:.1f} ms/s, SNR {snr:.1f} dB")
+
+
+async def bench_log(args):
+    # 热路径日志的单次开销：原来每个音频块一条的 print，与关闭级别的 logger.debug、开启并限流的 logger.info 对比，
+    # 输出按行缓冲写入 --sink（默认 /dev/null，与交互式控制台一样每行一次系统调用）；按 --devices 台设备、每台每秒 --rate 条估算占用的单核比例
+    import contextlib
+    import logging
+    from log_config import RateLimitFilter, StructuredFormatter
+
+    chunk = bytes(1000)
+    logger = logging.getLogger('benchmark.log')
+    logger.propagate = False
+    with open(args.sink, 'w', buffering=1) as sink:
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(StructuredFormatter())
+        logger.addHandler(handler)
+
+        def run(label, call):
+            start = time.process_time()
+            for _ in range(args.calls):
+                call()
+            per_call = (time.process_time() - start) / args.calls
+            results.append(f"{label}: {per_call * 1e6:.2f} us/call, {per_call * args.rate * args.devices * 100:.2f}% "
+                           f"of a core at {args.devices} devices x {args.rate}/s")
+
+        results = []
+        with contextlib.redirect_stdout(sink):
+            run("print (before)", lambda: print(f"Successfully wrote {len(chunk)} bytes to the push stream"))
+        logger.setLevel(logging.INFO)
+        run("logger.debug, disabled", lambda: logger.debug("Wrote %d bytes to the push stream", len(chunk)))
+        logger.setLevel(logging.DEBUG)
+        run("logger.debug, enabled", lambda: logger.debug("Wrote %d bytes to the push stream", len(chunk)))
+        handler.addFilter(RateLimitFilter(burst=5))
+        run("logger.debug, enabled, rate limited to 5/s",
+            lambda: logger.debug("Wrote %d bytes to the push stream", len(chunk)))
+        logger.removeHandler(handler)
+    print("\n".join(results))
+
+
+async def bench_llm(args):
+    # 对比连接池复用与每轮新建连接时的首 token 时间；未指定 --base-url 时启动进程内的 Dify 替身
+    from aiohttp import web
+    from dify_chat_client import DifyChatClient
+    from dify_stub_server import DifyStubServer
+
+    class FirstToken:
+        def __init__(self):
+            self.start = time.perf_counter()
+            self.latency = None
+
+        async def process_stream(self, delta):
+            if delta and self.latency is None:
+                self.latency = time.perf_counter() - self.start
+
+    runner = None
+    base_url = args.base_url
+    if not base_url:
+        runner = web.AppRunner(DifyStubServer(first_token_delay=0.0, token_interval=0.0).create_app())
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', args.port).start()
+        base_url = f"http://127.0.0.1:{args.port}"
+    for pooled in (False, True):
+        latencies = []
+        client = DifyChatClient(api_key=os.getenv('DIFY_API_KEY'), base_url=base_url)
+        for _ in range(args.turns):
+            processor = FirstToken()
+            await client.handle_dify_dialog(args.query, None, processor)
+            latencies.append(processor.latency or 0.0)
+            if not pooled:
+                await client.close()
+        await client.close()
+        latencies.sort()
+        print(f"{'pooled' if pooled else 'fresh connection'}: ttft p50={latencies[len(latencies) // 2] * 1000:.1f} ms "
+              f"mean={sum(latencies) / len(latencies) * 1000:.1f} ms over {args.turns} turns")
+    if runner:
+        await runner.cleanup()
+
+
+async def bench_stt(args):
+    # 以最快速度送入整段音频并立即结束识别，统计每核实时倍率（音频时长 / CPU 时间）
+    pcm = read_wav_pcm(args.wav)
+    audio_seconds = len(pcm) / 32000
+    backend = create_stt_backend(args.backend, args)
+    results = []
+    for _ in range(args.repeat):
+        done = asyncio.get_running_loop().create_future()
+
+        def on_recognized(text):
+            results.append(text)
+            if not done.done():
+                done.set_result(text)
+
+        backend.setup_recognizer(on_recognized)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        for start in range(0, len(pcm), args.chunk):
+            backend.process_audio_chunk(pcm[start:start + args.chunk])
+            await asyncio.sleep(0)
+        backend.stop_recognition()
+        await asyncio.wait_for(done, args.timeout)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        print(f"{args.backend}: {audio_seconds:.2f}s audio in {wall:.3f}s wall / {cpu:.3f}s cpu "
+              f"-> {audio_seconds / max(cpu, 1e-9):.1f}x realtime per core, text={results[-1]!r}")
+    backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YunDo server micro-benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    llm = subparsers.add_parser('llm', help="Dify time to first token, pooled vs fresh connections")
+    llm.add_argument('--base-url', help="Dify API base URL; defaults to an in-process stand-in server")
+    llm.add_argument('--port', type=int, default=8089)
+    llm.add_argument('--query', default="你好")
+    llm.add_argument('--turns', type=int, default=20)
+    llm.set_defaults(func=bench_llm)
+
+    stt = subparsers.add_parser('stt', help="speech recognition throughput per core")
+    stt.add_argument('--backend', choices=['stub', 'vosk', 'azure'], default='stub')
+    stt.add_argument('--wav', required=True, help="16 kHz 16-bit mono WAV file")
+    stt.add_argument('--vosk-model')
+    stt.add_argument('--chunk', type=int, default=1000)
+    stt.add_argument('--repeat', type=int, default=3)
+    stt.add_argument('--timeout', type=float, default=60.0)
+    stt.set_defaults(func=bench_stt)
+
+    vad = subparsers.add_parser('vad', help="voice activity detection cost per frame")
+    vad.add_argument('--wav', required=True, help="16 kHz 16-bit mono WAV file")
+    vad.add_argument('--chunk', type=int, default=1000)
+    vad.add_argument('--hangover-ms', type=int, default=300)
+    vad.add_argument('--repeat', type=int, default=3)
+    vad.set_defaults(func=bench_vad)
+
+    codec = subparsers.add_parser('codec', help="audio codec bitrate, CPU cost and quality")
+    codec.add_argument('--wav', required=True, help="16 kHz 16-bit mono WAV file")
+    codec.add_argument('--codecs', default='pcm,ulaw,adpcm,opus')
+    codec.add_argument('--chunk', type=int, default=32000)
+    codec.set_defaults(func=bench_codec)
+
+    log = subparsers.add_parser('log', help="hot-path logging overhead per call")
+    log.add_argument('--calls', type=int, default=200000)
+    log.add_argument('--devices', type=int, default=100)
+    log.add_argument('--rate', type=int, default=30, help="log calls per second per device (one per audio packet)")
+    log.add_argument('--sink', default=os.devnull, help="where log lines are written, e.g. /dev/tty")
+    log.set_defaults(func=bench_log)
+
+    tts = subparsers.add_parser('tts', help="speech synthesis time to first audio byte")
+    tts.add_argument('--backend', choices=['tone', 'command', 'azure'], default='tone')
+    tts.add_argument('--text', default="你好，今天天气不错，我们出去走走吧。")
+    tts.add_argument('--command', help="local synthesizer command emitting raw 16 kHz 16-bit mono PCM")
+    tts.add_argument('--realtime-factor', type=float, default=0.0)
+    tts.add_argument('--repeat', type=int, default=3)
+    tts.set_defaults(func=bench_tts)
+
+    reply = subparsers.add_parser('reply', help="multi-sentence reply duration vs. TTS concurrency")
+    reply.add_argument('--backend', choices=['tone', 'command', 'azure'], default='tone')
+    reply.add_argument('--text', default="好的，我明白了。今天天气不错。适合出门散步。记得带上水和帽子。傍晚可能会有小雨，早点回家。")
+    reply.add_argument('--concurrency', default='1,2,4')
+    reply.add_argument('--command', help="local synthesizer command emitting raw 16 kHz 16-bit mono PCM")
+    reply.add_argument('--realtime-factor', type=float, default=0.3, help="tone backend generation speed")
+    reply.add_argument('--latency', type=float, default=0.4, help="tone backend delay before the first chunk")
+    reply.add_argument('--repeat', type=int, default=1)
+    reply.add_argument('--max-lead', type=float, default=0.7, help="server pacing limit in seconds, 0 disables")
+    reply.add_argument('--preroll', type=float, default=0.2, help="device pre-roll before playback starts")
+    reply.add_argument('--device-buffer', type=float, default=1.0, help="device jitter buffer size in seconds")
+    reply.set_defaults(func=bench_reply)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
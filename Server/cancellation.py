@@ -0,0 +1,27 @@
+class CancellationToken:
+    # 标记一轮回复（LLM -> TTS -> 发布）；用户再次说话时取消，各阶段看到已取消的 token 就丢弃对应的工作
+    def __init__(self, trace=None):
+        self.cancelled = False
+        self.trace = trace  # 本轮的 TurnTrace，各阶段据此记录耗时
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class WastedWorkStats:
+    # 打断后避免的无效工作量
+    def __init__(self):
+        self.barge_ins = 0
+        self.llm_turns_cancelled = 0
+        self.tts_segments_dropped = 0
+        self.tts_chars_dropped = 0
+        self.audio_bytes_dropped = 0
+
+    def snapshot(self):
+        return {
+            'barge_ins': self.barge_ins,
+            'llm_turns_cancelled': self.llm_turns_cancelled,
+            'tts_segments_dropped': self.tts_segments_dropped,
+            'tts_chars_dropped': self.tts_chars_dropped,
+            'audio_bytes_dropped': self.audio_bytes_dropped,
+        }
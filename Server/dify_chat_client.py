@@ -1,48 +1,167 @@
-import requests
+import asyncio
+import codecs
 import json
+import logging
+import re
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class SSEParser:
+    # 增量解析 text/event-stream：按任意大小的字节块喂入，跨块的行和多字节 UTF-8 字符都能正确拼接，
+    # 空行时派发事件，返回 (event, data, id) 列表
+    LINE_END = re.compile(r"\r\n|\r|\n")
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ""
+        self.event = ""
+        self.data = []
+        self.last_id = ""
+
+    def feed(self, chunk):
+        text = self.pending + self.decoder.decode(chunk)
+        events = []
+        pos = 0
+        for match in self.LINE_END.finditer(text):
+            if match.group() == "\r" and match.end() == len(text):
+                break  # 末尾的 \r 可能与下一块开头的 \n 组成 \r\n
+            event = self.process_line(text[pos:match.start()])
+            if event:
+                events.append(event)
+            pos = match.end()
+        # 不完整的最后一行留到下一块再处理
+        self.pending = text[pos:]
+        return events
+
+    def process_line(self, line):
+        if not line:
+            if not self.data:
+                self.event = ""
+                return None
+            event = (self.event or "message", "\n".join(self.data), self.last_id)
+            self.event = ""
+            self.data = []
+            return event
+        if line.startswith(":"):
+            return None
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self.data.append(value)
+        elif field == "event":
+            self.event = value
+        elif field == "id":
+            self.last_id = value
+        return None
+
+    def close(self):
+        # 流结束时派发最后一个未以空行结尾的事件
+        events = []
+        if self.pending:
+            event = self.process_line(self.pending.rstrip("\r"))
+            self.pending = ""
+            if event:
+                events.append(event)
+        event = self.process_line("")
+        if event:
+            events.append(event)
+        return events
+
 
 class DifyChatClient:
-    def __init__(self, api_key, base_url, user_id='esp32-001', response_mode='streaming'):
+    # 所有设备共享一个连接池（HTTP/1.1 keep-alive），每轮对话复用已建立的 TCP+TLS 连接
+    def __init__(self, api_key, base_url, user_id='esp32-001', response_mode='streaming', pool_size=100,
+                 connect_timeout=5.0, read_timeout=30.0, keepalive_timeout=60.0):
         self.api_key = api_key
         self.base_url = base_url
         self.user_id = user_id
         self.response_mode = response_mode
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
 
-    def handle_dify_dialog(self, query, conversation_id, processor):
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "inputs": {},
-                "query": query,
-                "user": self.user_id,
-                "response_mode": self.response_mode,
-                "conversation_id": conversation_id
-            }
-
-            chat_response = requests.post(
-                f"{self.base_url}/chat-messages",
-                headers=headers,
-                json=payload,
-                stream=True
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.api_key}"}
             )
-            chat_response.raise_for_status()
+        return self.session
 
-            new_conversation_id = None
-            for line in chat_response.iter_lines(decode_unicode=True):
-                line = line.split('data:', 1)[-1].strip()
-                if line:
+    async def handle_dify_dialog(self, query, conversation_id, processor, user_id=None):
+        # 在任务被取消时（例如用户打断）会关闭连接并通知 Dify 停止生成，CancelledError 继续向上抛出
+        user = user_id or self.user_id
+        payload = {
+            "inputs": {},
+            "query": query,
+            "user": user,
+            "response_mode": self.response_mode,
+            "conversation_id": conversation_id
+        }
+        task_id = None
+        new_conversation_id = None
+        finished = False
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async with self.get_session().post(f"{self.base_url}/chat-messages", json=payload) as chat_response:
+                chat_response.raise_for_status()
+                async for _, data, _ in self.iter_events(chat_response):
                     try:
-                        line_json = json.loads(line)
-                        processor.process_stream(line_json.get('answer'))
-                        if 'conversation_id' in line_json:
-                            new_conversation_id = line_json['conversation_id']
+                        line_json = json.loads(data)
                     except json.JSONDecodeError:
-                        print(f"Error decoding JSON: {line}")
-
+                        logger.warning("Error decoding JSON: %s", data)
+                        continue
+                    task_id = line_json.get('task_id', task_id)
+                    if 'conversation_id' in line_json:
+                        new_conversation_id = line_json['conversation_id']
+                    event = line_json.get('event')
+                    if event in ('message', 'agent_message'):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                            logger.debug("Dify time to first token: %.0f ms", first_token * 1000)
+                        await processor.process_stream(line_json.get('answer'))
+                    elif event == 'message_end':
+                        finished = True
+                        await processor.process_stream(None)
+                    elif event == 'error':
+                        logger.error("Dify error: %s", line_json.get('message'))
+            if not finished:
+                await processor.process_stream(None)
             return new_conversation_id
+        except asyncio.CancelledError:
+            if task_id and not finished:
+                asyncio.get_running_loop().create_task(self.stop_generation(task_id, user))
+            raise
+        except Exception as e:
+            logger.error("Error handling dialog: %s", e)
+            return None
+
+    @staticmethod
+    async def iter_events(response):
+        parser = SSEParser()
+        async for chunk in response.content.iter_any():
+            for event in parser.feed(chunk):
+                yield event
+        for event in parser.close():
+            yield event
+
+    async def stop_generation(self, task_id, user):
+        try:
+            async with self.get_session().post(f"{self.base_url}/chat-messages/{task_id}/stop",
+                                               json={"user": user}) as response:
+                response.raise_for_status()
         except Exception as e:
-            print(f"Error handling dialog: {e}")
-            return None
\ No newline at end of file
+            logger.warning("Error stopping Dify task %s: %s", task_id, e)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import json
+import uuid
+
+from aiohttp import web
+
+
+class DifyStubServer:
+    # 本地 Dify 替身：实现 /chat-messages 的 SSE 流式接口和 /chat-messages/{task_id}/stop，
+    # 按固定的首包延迟和逐 token 间隔回放预设回复，用于测试 DifyChatClient 和压测整条流水线
+    def __init__(self, replies=None, first_token_delay=0.3, token_interval=0.03, token_size=2):
+        self.replies = replies or ["好的，我明白了。今天天气不错，适合出门散步，记得带上水哦。"]
+        self.first_token_delay = first_token_delay
+        self.token_interval = token_interval
+        self.token_size = token_size
+        self.requests = 0
+        self.stopped_tasks = set()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/chat-messages', self.chat_messages)
+        app.router.add_post('/chat-messages/{task_id}/stop', self.stop)
+        return app
+
+    @staticmethod
+    def sse(payload):
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+    async def chat_messages(self, request):
+        body = await request.json()
+        reply = self.replies[self.requests % len(self.replies)]
+        self.requests += 1
+        task_id = str(uuid.uuid4())
+        conversation_id = body.get('conversation_id') or str(uuid.uuid4())
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for start in range(0, len(reply), self.token_size):
+                if task_id in self.stopped_tasks:
+                    break
+                await response.write(self.sse({'event': 'message', 'task_id': task_id,
+                                               'conversation_id': conversation_id,
+                                               'answer': reply[start:start + self.token_size]}))
+                await asyncio.sleep(self.token_interval)
+            await response.write(self.sse({'event': 'message_end', 'task_id': task_id,
+                                           'conversation_id': conversation_id}))
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # 客户端中途断开（例如被打断）
+        return response
+
+    async def stop(self, request):
+        self.stopped_tasks.add(request.match_info['task_id'])
+        return web.json_response({'result': 'success'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Dify chat-messages API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--token-interval', type=float, default=0.03)
+    parser.add_argument('--reply', action='append', help="reply text, may be given several times")
+    args = parser.parse_args()
+    server = DifyStubServer(replies=args.reply, first_token_delay=args.first_token_delay,
+                            token_interval=args.token_interval)
+    web.run_app(server.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import paho.mqtt.client as mqtt
+
+from audio_codec import create_codec
+from benchmark import read_wav_pcm
+from uplink import FRAME_HEADER
+
+# 模拟多台设备的压测工具：每台模拟设备按固件 Firmware/audio_system.py 的协议与服务端交互——
+# 在 ctrl/<id> 上报编码能力并等待 ack，按实时速度在 mic/<id> 发布带帧头的 160ms 音频帧，
+# 说完后发送 {"event": "speech_end"}，再从 audio/<id> 接收回复音频。
+# 默认同时启动服务端（STT_BACKEND=stub、TTS_BACKEND=tone）和 Dify 替身，逐级增加设备数，
+# 统计吞吐和端到端延迟（speech_end -> 首个回复音频包）的 p50/p95/p99
+
+FRAME_MS = 160
+FRAME_BYTES = FRAME_MS * 32  # 16kHz/16bit 单声道
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    # 最近秩法
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class SimulatedDevice:
+    def __init__(self, device_id, args, pcm, loop):
+        self.device_id = device_id
+        self.args = args
+        self.loop = loop
+        self.codec = create_codec(args.codec)
+        self.downlink = create_codec(args.codec)
+        self.frames = [pcm[offset:offset + FRAME_BYTES] for offset in range(0, len(pcm), FRAME_BYTES)]
+        self.seq = 0
+        self.utterance_id = 0
+        self.ack = asyncio.Event()
+        self.hello = json.dumps({'codecs': [args.codec], 'downlink': [args.codec], 'uplink_header': True})
+        self.audio = asyncio.Queue()
+        self.latencies = []
+        self.reply_times = []
+        self.send_lag = []
+        self.uplink_bytes = 0
+        self.reply_bytes = 0
+        self.reply_seconds = 0.0
+        self.timeouts = 0
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=device_id)
+        self.client.on_message = self.on_message
+
+    def on_message(self, client, userdata, message):
+        # paho 网络线程中回调，转交给事件循环
+        if message.topic.endswith('/ack'):
+            if b'hello_request' in message.payload:
+                # 服务端重启后请设备重新上报能力，与固件行为一致
+                client.publish(self.topic(self.args.ctrl_topic), self.hello)
+            else:
+                self.loop.call_soon_threadsafe(self.ack.set)
+        else:
+            self.loop.call_soon_threadsafe(self.audio.put_nowait, (time.perf_counter(), message.payload))
+
+    def topic(self, base):
+        return f"{base}/{self.device_id}"
+
+    async def connect(self):
+        self.client.connect(self.args.broker, self.args.port)
+        self.client.loop_start()
+        self.client.subscribe([(self.topic(self.args.audio_topic), 0),
+                               (self.topic(self.args.ctrl_topic) + '/ack', 0)])
+        for _ in range(5):
+            self.client.publish(self.topic(self.args.ctrl_topic), self.hello)
+            try:
+                await asyncio.wait_for(self.ack.wait(), 2.0)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def speak(self):
+        # 按实时速度发送一句话，发送时刻相对计划时刻的滞后反映模拟端自身是否跟得上
+        self.utterance_id = (self.utterance_id + 1) & 0xFFFF
+        start = time.perf_counter()
+        for i, frame in enumerate(self.frames):
+            delay = start + i * FRAME_MS / 1000 - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.send_lag.append(max(0.0, -delay))
+            header = FRAME_HEADER.pack(self.seq, self.utterance_id, int(time.monotonic() * 1000) & 0xFFFFFFFF)
+            payload = header + self.codec.encode(frame)
+            self.client.publish(self.topic(self.args.mic_topic), payload)
+            self.uplink_bytes += len(payload)
+            self.seq = (self.seq + 1) & 0xFFFF
+        self.client.publish(self.topic(self.args.ctrl_topic), json.dumps({'event': 'speech_end'}))
+        return time.perf_counter()
+
+    async def receive_reply(self, speech_end):
+        # 首包超时记为失败；之后 reply_gap 秒内没有新音频视为本轮回复结束
+        try:
+            arrived, payload = await asyncio.wait_for(self.audio.get(), self.args.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+        self.latencies.append(arrived - speech_end)
+        last = arrived
+        while True:
+            self.reply_bytes += len(payload)
+            self.reply_seconds += len(self.downlink.decode(payload)) / 32000
+            try:
+                last, payload = await asyncio.wait_for(self.audio.get(), self.args.reply_gap)
+            except asyncio.TimeoutError:
+                break
+        self.reply_times.append(last - speech_end)
+
+    async def run(self):
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+        for _ in range(self.args.turns):
+            speech_end = await self.speak()
+            await self.receive_reply(speech_end)
+            await asyncio.sleep(self.args.think_time)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+async def run_fleet(args, pcm, size, run_id):
+    loop = asyncio.get_running_loop()
+    devices = [SimulatedDevice(f"sim{run_id}-{i}", args, pcm, loop) for i in range(size)]
+    connected = await asyncio.gather(*(device.connect() for device in devices))
+    if not all(connected):
+        print(f"{size} devices: {connected.count(False)} devices got no codec ack, is the server running?")
+    start = time.perf_counter()
+    await asyncio.gather(*(device.run() for device in devices))
+    elapsed = time.perf_counter() - start
+    for device in devices:
+        device.close()
+
+    latencies = [x for device in devices for x in device.latencies]
+    reply_times = [x for device in devices for x in device.reply_times]
+    send_lag = [x for device in devices for x in device.send_lag]
+    timeouts = sum(device.timeouts for device in devices)
+    uplink_seconds = size * args.turns * len(devices[0].frames) * FRAME_MS / 1000
+    reply_seconds = sum(device.reply_seconds for device in devices)
+    print(f"{size:4d} devices: {len(latencies)}/{size * args.turns} turns in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed:.2f} turns/s, {timeouts} timeouts), "
+          f"uplink {uplink_seconds / elapsed:.1f}x realtime, reply audio {reply_seconds / elapsed:.1f}x realtime")
+    print(f"      first audio p50={percentile(latencies, 50) * 1000:.0f} ms p95={percentile(latencies, 95) * 1000:.0f} ms "
+          f"p99={percentile(latencies, 99) * 1000:.0f} ms | full reply p50={percentile(reply_times, 50) * 1000:.0f} ms "
+          f"p99={percentile(reply_times, 99) * 1000:.0f} ms | send lag p99={percentile(send_lag, 99) * 1000:.1f} ms")
+
+
+def start_stand_ins(args):
+    # 启动 Dify 替身和使用本地替身后端的服务端，返回子进程列表
+    directory = os.path.dirname(os.path.abspath(__file__))
+    transcripts = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8')
+    transcripts.write(args.transcript + "\n")
+    transcripts.close()
+    dify = subprocess.Popen([sys.executable, os.path.join(directory, 'dify_stub_server.py'),
+                             '--port', str(args.dify_port),
+                             '--first-token-delay', str(args.first_token_delay),
+                             '--token-interval', str(args.token_interval)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ,
+               MQTT_BROKER=args.broker, MQTT_AUDIO_TOPIC=args.audio_topic, MQTT_MIC_TOPIC=args.mic_topic,
+               MQTT_CTRL_TOPIC=args.ctrl_topic, DIFY_API_KEY='fleet-simulator',
+               DIFY_BASE_URL=f"http://127.0.0.1:{args.dify_port}",
+               STT_BACKEND='stub', STUB_TRANSCRIPTS=transcripts.name, TTS_BACKEND='tone',
+               TONE_REALTIME_FACTOR=str(args.tone_realtime_factor),
+               # 句尾由模拟设备的 speech_end 决定，与开启设备端 VAD 的固件一致
+               VAD_ENABLED='false')
+    server = subprocess.Popen([sys.executable, os.path.join(directory, 'main.py')], cwd=directory, env=env,
+                              stdout=None if args.server_output else subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    return [server, dify], transcripts.name
+
+
+async def simulate(args):
+    pcm = read_wav_pcm(args.wav)
+    processes, transcripts = [], None
+    if not args.external_server:
+        processes, transcripts = start_stand_ins(args)
+        await asyncio.sleep(args.startup_delay)
+    try:
+        for run_id, size in enumerate(int(n) for n in args.devices.split(',')):
+            await run_fleet(args, pcm, size, run_id)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if transcripts:
+            os.unlink(transcripts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated device fleet for load testing the YunDo server")
+    parser.add_argument('--wav', required=True, help="16 kHz 16-bit mono WAV file spoken by every device each turn")
+    parser.add_argument('--devices', default='1,5,10,20', help="comma separated fleet sizes, run one after another")
+    parser.add_argument('--turns', type=int, default=3, help="turns per device")
+    parser.add_argument('--codec', choices=['pcm', 'ulaw', 'adpcm'], default='pcm')
+    parser.add_argument('--think-time', type=float, default=0.5, help="pause between a reply and the next turn")
+    parser.add_argument('--ramp', type=float, default=1.0, help="devices start at random offsets within this window")
+    parser.add_argument('--timeout', type=float, default=15.0, help="seconds to wait for the first reply audio")
+    parser.add_argument('--reply-gap', type=float, default=1.0, help="silence that marks the end of a reply")
+    parser.add_argument('--broker', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883, help="broker port (a spawned server always uses 1883)")
+    parser.add_argument('--audio-topic', default='audio')
+    parser.add_argument('--mic-topic', default='mic')
+    parser.add_argument('--ctrl-topic', default='ctrl')
+    parser.add_argument('--external-server', action='store_true',
+                        help="use an already running server instead of starting one with stand-in backends")
+    parser.add_argument('--server-output', action='store_true', help="show the spawned server's log")
+    parser.add_argument('--startup-delay', type=float, default=3.0)
+    parser.add_argument('--transcript', default="今天天气怎么样", help="text returned by the stub recognizer")
+    parser.add_argument('--dify-port', type=int, default=8089)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--token-interval', type=float, default=0.03)
+    parser.add_argument('--tone-realtime-factor', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(simulate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import json
+import logging
+from collections import deque
+
+from speculation import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    # 多模式匹配自动机：一次扫描文本即可找出所有模式的出现位置，耗时与模式数量无关
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # 每个状态结束的 (模式长度, 值)
+        for pattern, value in patterns:
+            self.add(pattern, value)
+        self.build()
+
+    def add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((len(pattern), value))
+
+    def build(self):
+        # 按层次计算失配指针，并把失配状态的输出合并进来
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fail = self.fail[state]
+                    while fail and char not in self.goto[fail]:
+                        fail = self.fail[fail]
+                    self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        # 返回 (起始位置, 结束位置, 值) 列表
+        matches = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                matches.append((i + 1 - length, i + 1, value))
+        return matches
+
+
+class Intent:
+    def __init__(self, command, phrases, ack=None):
+        self.command = command
+        self.phrases = phrases
+        self.ack = ack
+
+
+class IntentMatcher:
+    # 本地指令表：识别文本基本就是某个指令的说法（同义词）时直接得到指令，不必经过 LLM。
+    # 去掉说法后剩余不超过 max_extra_chars 个字，且剩余部分只由客套词（fillers，“请”、“一下”之类）组成、不含否定词才算命中：
+    # “请前进一下”命中，“停车场在哪”、“向前看”这类普通问句仍交给 LLM，误发动作指令比多一次 LLM 往返更糟。
+    # 命中多个不同指令时同样交给 LLM
+    NEGATIONS = ("不", "别", "没", "勿")
+    FILLERS = ("请", "帮我", "给我", "麻烦", "一下", "马上", "现在", "赶紧", "快", "吧", "啊", "呀", "哦", "了")
+
+    def __init__(self, intents, max_extra_chars=4, negations=NEGATIONS, fillers=FILLERS):
+        self.intents = intents
+        self.max_extra_chars = max_extra_chars
+        self.negations = negations
+        self.fillers = sorted(fillers, key=len, reverse=True)  # 先去掉较长的词
+        self.phrases = [(normalize(phrase), intent) for intent in intents for phrase in intent.phrases]
+        self.phrases = [(phrase, intent) for phrase, intent in self.phrases if phrase]
+        self.automaton = AhoCorasick(self.phrases)
+        self.longest = max((len(phrase) for phrase, _ in self.phrases), default=0)
+        self.matches = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        # {"intents": [{"command": "前进", "phrases": ["前进", "往前走"], "ack": "好的"}], "negations": [...], "fillers": [...]}
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+        intents = [Intent(entry['command'], entry.get('phrases') or [entry['command']], entry.get('ack'))
+                   for entry in table.get('intents', [])]
+        for key in ('negations', 'fillers'):
+            if key in table:
+                kwargs.setdefault(key, tuple(table[key]))
+        logger.info("Loaded %d local intents from %s", len(intents), path)
+        return cls(intents, **kwargs)
+
+    def match(self, text):
+        text = normalize(text)
+        if not text or len(text) > self.longest + self.max_extra_chars:
+            return None
+        matches = self.automaton.search(text)
+        if not matches:
+            return None
+        # 取最长的说法；包含在它里面的较短说法不算，其余位置还命中其他指令则有歧义
+        start, end, intent = max(matches, key=lambda match: match[1] - match[0])
+        if (any(other is not intent and (s < start or e > end) for s, e, other in matches)
+                or not self.accept(text[:start] + text[end:])):
+            self.rejected += 1
+            return None
+        self.matches += 1
+        return intent
+
+    def accept(self, rest):
+        if len(rest) > self.max_extra_chars or any(word in rest for word in self.negations):
+            return False
+        for word in self.fillers:
+            rest = rest.replace(word, "")
+        return not rest
+
+    def snapshot(self):
+        return {
+            'intent_matches': self.matches,
+            'intent_rejected': self.rejected,
+        }
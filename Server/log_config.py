@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    # 按“logger + 消息模板”限流：每个 interval 秒内最多放行 burst 条，其余只计数，
+    # 下一个窗口放行的第一条记录带上被抑制的条数。模板相同、参数不同的日志（例如每个音频块一条）算作同一类。
+    # 每条都必须保留的记录（例如回合追踪）用 extra={'rate_limit': False} 跳过限流
+    def __init__(self, interval=1.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}  # (logger, 模板) -> [窗口开始时间, 已放行条数, 已抑制条数]
+
+    def filter(self, record):
+        if not getattr(record, 'rate_limit', True):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None and len(self.windows) >= 4096:
+            self.windows.clear()  # 防止拼接好的消息（非模板）让字典无限增长
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            window = self.windows[key] = [now, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+        if window[1] >= self.burst:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    # text：一行可读文本，附加字段以 key=value 形式跟在后面；json：每条日志一个 JSON 对象，便于日志系统检索
+    def __init__(self, json_output=False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', None) or {})
+        if getattr(record, 'suppressed', 0):
+            fields['suppressed'] = record.suppressed
+        if self.json_output:
+            entry = {'ts': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+                     'msg': record.getMessage(), **fields}
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={json.dumps(value, ensure_ascii=False)}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level=None, fmt=None, rate_limit=None):
+    # LOG_LEVEL：DEBUG/INFO/WARNING/ERROR；LOG_FORMAT：text/json；LOG_RATE_LIMIT：同一条日志每秒最多输出的条数，0 不限流。
+    # 级别以下的日志在 logger.debug() 里直接返回，不会格式化参数，热路径上关闭的日志几乎没有开销
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+    rate_limit = int(os.getenv('LOG_RATE_LIMIT', 5)) if rate_limit is None else rate_limit
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_output=fmt == 'json'))
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(burst=rate_limit))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # 第三方库的调试日志量很大，只保留警告
+    for name in ('asyncio', 'aiohttp', 'paho'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    return handler
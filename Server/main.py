@@ -1,31 +1,38 @@
+import asyncio
+import json
+import logging
 import os
-import threading
-from queue import Queue
+import time
 from dotenv import load_dotenv
 import azure.cognitiveservices.speech as speechsdk
-import time
 
-from azure_speech_service import AzureSpeechService
+from audio_codec import UPLINK_CODECS, negotiate_codec
+from azure_speech_service import AzureSTTBackend, AzureTTSBackend, RecognizerPoolStats
+from cancellation import CancellationToken, WastedWorkStats
 from dify_chat_client import DifyChatClient
+from intent_matcher import IntentMatcher
+from log_config import configure_logging
 from mqtt_service import MQTTService
+from session_manager import SessionManager
+from speculation import SpeculationStats, Speculator
 from stream_processor import StreamProcessor
+from stt_backend import StubSTTBackend, VoskSTTBackend
+from tracing import MetricsServer, TurnMetrics
+from tts_backend import CommandTTSBackend, ToneTTSBackend
+from tts_cache import CachedTTSBackend, TTSCache
+from tts_service import TTSService
+from uplink import UplinkReassembler
+from vad import VoiceActivityDetector
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 class Application:
     def __init__(self):
-        self.data_queue = Queue()
-        self.azure_speech_service = AzureSpeechService(
-            speech_key=os.getenv('SPEECH_KEY'),
-            service_region=os.getenv('SERVICE_REGION'),
-            mqtt_audio_topic=os.getenv('MQTT_AUDIO_TOPIC'),
-            robot_topic=os.getenv('MQTT_ROBOT_TOPIC'),
-            recognition_language=os.getenv('RECOGNITION_LANGUAGE'),
-            synthesis_voice_name=os.getenv('SYNTHESIS_VOICE_NAME'),
-            output_format=speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm,
-            data_queue=self.data_queue
-        )
+        # TTS -> MQTT 发布之间的有界队列，队列满时合成端等待，形成背压
+        self.data_queue = asyncio.Queue(maxsize=int(os.getenv('PUBLISH_QUEUE_SIZE', 64)))
 
         self.mqtt_service = MQTTService(
             broker=os.getenv('MQTT_BROKER'),
@@ -35,71 +42,369 @@ class Application:
             robot_topic=os.getenv('MQTT_ROBOT_TOPIC'),
             user=os.getenv('MQTT_USER'),
             password=os.getenv('MQTT_PASSWORD'),
-            client_id="robot_server"
+            client_id="robot_server",
+            ctrl_topic=os.getenv('MQTT_CTRL_TOPIC', 'ctrl')
         )
+        # 服务端允许协商的音频编码，按设备给出的偏好顺序选用
+        self.audio_codecs = [name.strip() for name in os.getenv('AUDIO_CODECS', 'opus,adpcm,ulaw,pcm').split(',')]
 
         self.dify_chat_client = DifyChatClient(
             api_key=os.getenv('DIFY_API_KEY'),
-            base_url=os.getenv('DIFY_BASE_URL')
+            base_url=os.getenv('DIFY_BASE_URL'),
+            connect_timeout=float(os.getenv('DIFY_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(os.getenv('DIFY_READ_TIMEOUT', 30))
         )
 
-        self.conversation_ids = {}  # 用于存储每个设备的conversation_id
+        # 所有会话共享的 TTS 缓存，TTS_CACHE_BYTES 为 0 时关闭
+        cache_bytes = int(os.getenv('TTS_CACHE_BYTES', 64 * 1024 * 1024))
+        self.tts_cache = TTSCache(max_bytes=cache_bytes, directory=os.getenv('TTS_CACHE_DIR') or None) \
+            if cache_bytes > 0 else None
 
-        self.stream_processor = StreamProcessor(self.azure_speech_service)
+        # 用户打断回复时被取消的工作量统计
+        self.stats = WastedWorkStats()
+        # Azure 识别池的命中和预热耗时统计，所有设备共用
+        self.recognizer_pool_stats = RecognizerPoolStats()
+        # 根据识别中间结果提前请求 LLM（SPECULATION_ENABLED），统计命中率和被丢弃请求浪费的 token
+        self.speculation_enabled = os.getenv('SPECULATION_ENABLED', 'false').lower() == 'true'
+        self.speculation_stats = SpeculationStats()
+        # 距上一轮回复超过这么久再说话时开始新对话（0 表示一直延续），新对话的第一句可以投机
+        self.conversation_timeout = float(os.getenv('CONVERSATION_IDLE_TIMEOUT', 120))
+        # 本地指令表（INTENT_TABLE，JSON）：命中的短句直接下发机器人指令并播放确认语，不请求 LLM
+        intent_table = os.getenv('INTENT_TABLE')
+        self.intent_matcher = IntentMatcher.from_file(
+            intent_table,
+            max_extra_chars=int(os.getenv('INTENT_MAX_EXTRA_CHARS', 4))
+        ) if intent_table else None
+        self.warmup_task = None  # 启动时预先合成指令确认语
+        # 每轮对话各阶段耗时，METRICS_PORT 为 0 时不开启 /metrics 接口
+        self.metrics = TurnMetrics()
+        metrics_port = int(os.getenv('METRICS_PORT', 9464))
+        self.metrics_server = MetricsServer(self.render_metrics, port=metrics_port) if metrics_port else None
 
-    def main(self):
-        try:
-            print("Setting up speech recognizer...")
-            self.azure_speech_service.setup_recognizer(self.handle_recognized_text)
+        # 每台设备一个会话，会话内保存该设备的识别器、conversation_id 和回传主题
+        self.session_manager = SessionManager(
+            audio_topic=os.getenv('MQTT_AUDIO_TOPIC'),
+            robot_topic=os.getenv('MQTT_ROBOT_TOPIC'),
+            session_factory=self.create_session,
+            idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', 300)),
+            stats=self.stats,
+            metrics=self.metrics
+        )
+
+    def create_recognizer(self):
+        # STT_BACKEND 选择识别引擎：azure（默认）、vosk（本地离线）、stub（按文件返回固定文本，用于压测）
+        backend = os.getenv('STT_BACKEND', 'azure')
+        speech_timeout = float(os.getenv('SPEECH_TIMEOUT', 2.0))
+        if backend == 'vosk':
+            return VoskSTTBackend(model_path=os.getenv('VOSK_MODEL_PATH'), speech_timeout=speech_timeout)
+        if backend == 'stub':
+            return StubSTTBackend.from_file(os.getenv('STUB_TRANSCRIPTS'), speech_timeout=speech_timeout)
+        return AzureSTTBackend(
+            speech_key=os.getenv('SPEECH_KEY'),
+            service_region=os.getenv('SERVICE_REGION'),
+            recognition_language=os.getenv('RECOGNITION_LANGUAGE'),
+            speech_timeout=speech_timeout,
+            pool_size=int(os.getenv('STT_POOL_SIZE', 1)),
+            pool_stats=self.recognizer_pool_stats,
+            partial_results=self.speculation_enabled
+        )
 
-            print("Setting up MQTT...")
-            self.mqtt_service.listen_mqtt(self.on_message_callback)
+    def create_synthesizer(self):
+        backend = self.create_synthesis_backend()
+        if self.tts_cache is None:
+            return backend
+        voice = f"{os.getenv('TTS_BACKEND', 'azure')}:{os.getenv('SYNTHESIS_VOICE_NAME')}"
+        return CachedTTSBackend(backend, self.tts_cache, voice=voice, output_format='Raw16Khz16BitMonoPcm',
+                                max_text_length=int(os.getenv('TTS_CACHE_MAX_TEXT', 20)))
 
-            # Keep the main thread running
-            while not self.azure_speech_service.done:
-                time.sleep(0.1)
+    def create_synthesis_backend(self):
+        # TTS_BACKEND 选择合成引擎：azure（默认）、command（本地合成程序，输出原始 PCM）、tone（正弦音替身）
+        backend = os.getenv('TTS_BACKEND', 'azure')
+        if backend == 'command':
+            return CommandTTSBackend(os.getenv('TTS_COMMAND'))
+        if backend == 'tone':
+            return ToneTTSBackend(realtime_factor=float(os.getenv('TONE_REALTIME_FACTOR', 0)),
+                                  latency=float(os.getenv('TONE_LATENCY', 0)))
+        return AzureTTSBackend(
+            speech_key=os.getenv('SPEECH_KEY'),
+            service_region=os.getenv('SERVICE_REGION'),
+            synthesis_voice_name=os.getenv('SYNTHESIS_VOICE_NAME'),
+            output_format=speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm
+        )
+
+    def create_session(self, session):
+        session.recognizer = self.create_recognizer()
+        if os.getenv('VAD_ENABLED', 'true').lower() == 'true':
+            session.vad = VoiceActivityDetector(hangover_ms=int(os.getenv('VAD_HANGOVER_MS', 300)))
+        # 打断依赖 VAD 判断用户开始说话
+        session.barge_in_enabled = os.getenv('BARGE_IN_ENABLED', 'true').lower() == 'true'
+        session.tts_service = TTSService(
+            backend=self.create_synthesizer(),
+            mqtt_audio_topic=session.audio_topic,
+            robot_topic=session.robot_topic,
+            data_queue=self.data_queue,
+            stats=session.stats,
+            # 同时合成的片段数，每个并发片段使用单独的合成器实例（按需创建）
+            concurrency=int(os.getenv('TTS_CONCURRENCY', 2)),
+            backend_factory=self.create_synthesizer,
+            metrics=self.metrics,
+            # 设备端最多缓冲的回复音频（秒），需小于固件抖动缓冲区减去预缓冲
+            max_lead=float(os.getenv('DOWNLINK_MAX_LEAD', 0.7))
+        )
+        session.stream_processor = StreamProcessor(session.tts_service)
+        partial_callback = no_result_callback = None
+        if self.speculation_enabled:
+            session.speculator = Speculator(
+                lambda text, stream: self.speculate(session, text, stream),
+                stable_interval=float(os.getenv('SPECULATION_STABLE_MS', 400)) / 1000,
+                stats=self.speculation_stats
+            )
+            partial_callback = session.speculator.on_partial
+            no_result_callback = session.speculator.no_result
+        session.recognizer.setup_recognizer(session.submit_text, partial_callback, no_result_callback)
+        self.restore_audio(session)
+        session.start_task(self.llm_worker(session))
+        session.start_task(session.tts_service.tts_worker())
+
+    async def main(self):
+        try:
+            self.session_manager.start()
+            if self.metrics_server:
+                await self.metrics_server.start()
+            sender_task = asyncio.create_task(self.mqtt_sender())
+            if self.intent_matcher and self.tts_cache is not None:
+                self.warmup_task = asyncio.create_task(self.warm_intent_acks())
+
+            logger.info("Setting up MQTT")
+            await self.mqtt_service.listen_mqtt(self.on_message_callback)
+            sender_task.cancel()
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.exception("An error occurred: %s", e)
         finally:
-            print("Application is shutting down...")
+            logger.info("Application is shutting down")
+            if self.warmup_task:
+                self.warmup_task.cancel()
+            self.session_manager.stop()
+            AzureSTTBackend.close_pools()
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            await self.dify_chat_client.close()
+
+    def render_metrics(self):
+        gauges = {'active_sessions': len(self.session_manager.sessions),
+                  'speculation_hit_rate': round(self.speculation_stats.hit_rate(), 4)}
+        counters = {**self.stats.snapshot(), **self.session_manager.uplink_snapshot(),
+                    **self.recognizer_pool_stats.snapshot(),
+                    **self.speculation_stats.snapshot(),
+                    **(self.intent_matcher.snapshot() if self.intent_matcher else {})}
+        if self.tts_cache is not None:
+            # 命中、未命中和淘汰是累计值，其余是当前状态
+            cache = self.tts_cache.stats()
+            counters.update({f'tts_cache_{name}': cache[name] for name in ('hits', 'misses', 'evictions')})
+            gauges.update({'tts_cache_hit_rate': round(cache['hit_rate'], 4), 'tts_cache_entries': cache['entries'],
+                           'tts_cache_bytes': cache['bytes']})
+        return self.metrics.render(gauges=gauges, counters=counters)
 
     def on_message_callback(self, nil, userdata, message):
-        if message.topic == self.mqtt_service.MQTT_MIC_TOPIC:
-            self.azure_speech_service.process_audio_chunk(message.payload)
+        device_id = self.mqtt_service.mic_device_id(message.topic)
+        if device_id is not None:
+            session = self.session_manager.get_session(device_id)
+            session.process_audio(message.payload)
+            return
+        device_id = self.mqtt_service.ctrl_device_id(message.topic)
+        if device_id is not None:
+            self.handle_control_message(device_id, message.payload)
+
+    def handle_control_message(self, device_id, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Invalid control message from %s: %r", device_id, payload[:64])
+            return
+        if 'codecs' in message and device_id not in self.session_manager.sessions:
+            # 新建的会话直接按这次上报的能力协商
+            self.session_manager.hellos[device_id] = message
+            self.session_manager.get_session(device_id)
+            return
+        session = self.session_manager.get_session(device_id)
+        if message.get('event') == 'speech_end':
+            # 设备端 VAD 检测到句尾（或松开按键），不再等待服务端 VAD 或超时
+            session.end_of_speech()
+        elif message.get('event') == 'reset_conversation':
+            self.reset_conversation(device_id)
+        elif 'codecs' in message:
+            self.negotiate_audio(session, message)
+
+    def restore_audio(self, session):
+        # 会话被回收（空闲超时）后重建：设备不会再发 hello，沿用上次协商的结果；
+        # 服务端重启后没有记录时请设备重新上报，期间的麦克风数据丢弃。旧固件（无设备 ID）一直使用 PCM
+        if not session.device_id or not self.mqtt_service.MQTT_CTRL_TOPIC:
+            return
+        hello = self.session_manager.hellos.get(session.device_id)
+        if hello is not None:
+            self.negotiate_audio(session, hello)
+            return
+        session.hello_deadline = time.monotonic() + float(os.getenv('HELLO_TIMEOUT', 2.0))
+        self.publish_ctrl(session.device_id, json.dumps({'event': 'hello_request'}))
+        logger.info("Requested capabilities from device %s", session.device_id)
+
+    def negotiate_audio(self, session, hello):
+        # 设备连接后上报 {"codecs": [...], "downlink": [...]}，服务端选定编码并回复到 <ctrl>/<device_id>/ack，
+        # 设备收到后再切换。downlink 为可选的能力声明（例如带 Opus 解码模块的固件），缺省时与上行相同
+        device_id = session.device_id
+        self.session_manager.hellos[device_id] = hello
+        session.hello_deadline = None
+        codec = negotiate_codec(hello.get('codecs'), self.audio_codecs, allowed=UPLINK_CODECS)
+        downlink = negotiate_codec(hello.get('downlink', [codec]), self.audio_codecs)
+        session.set_codec(codec, downlink)
+        self.session_manager.retire_uplink(session)
+        session.uplink = None
+        if hello.get('uplink_header'):
+            session.uplink = UplinkReassembler(window=int(os.getenv('UPLINK_REORDER_WINDOW', 4)),
+                                               delay_histogram=self.metrics.uplink_delay)
+        ack = json.dumps({'codec': session.codec.name, 'downlink': session.downlink_codec.name,
+                          'uplink_header': session.uplink is not None})
+        self.publish_ctrl(device_id, ack)
 
-    def handle_recognized_text(self, recognized_text):
+    def publish_ctrl(self, device_id, message):
+        topic = f"{self.mqtt_service.MQTT_CTRL_TOPIC}/{device_id}/ack"
+        try:
+            self.data_queue.put_nowait((topic, message, CancellationToken()))
+        except asyncio.QueueFull:
+            logger.warning("Dropping control message for device %s: publish queue is full", device_id)
+
+    async def llm_worker(self, session):
+        while True:
+            recognized_text, trace, speculation = await session.text_queue.get()
+            # 每轮回复放在单独的任务里，打断时只取消这一轮，worker 继续处理下一句
+            session.begin_turn(trace)
+            intent = self.intent_matcher.match(recognized_text) if self.intent_matcher else None
+            if intent is not None:
+                if speculation is not None:
+                    session.speculator.reject(speculation)  # 输出不会再用，计入浪费
+                session.llm_task = asyncio.create_task(self.handle_intent(session, recognized_text, intent))
+            elif speculation is not None:
+                session.speculator.accept(speculation)
+                session.llm_task = asyncio.create_task(self.commit_speculation(session, recognized_text, speculation))
+            else:
+                session.llm_task = asyncio.create_task(self.handle_recognized_text(session, recognized_text))
+            try:
+                await asyncio.wait({session.llm_task})
+            except asyncio.CancelledError:
+                session.llm_task.cancel()
+                raise
+            if session.llm_task.cancelled():
+                self.stats.llm_turns_cancelled += 1
+                logger.info("Reply cancelled, wasted work so far", extra={'fields': self.stats.snapshot()})
+                if trace is not None:
+                    trace.finish('cancelled')
+            elif session.llm_task.exception() is not None:
+                logger.error("Error handling recognized text: %s", session.llm_task.exception())
+                if trace is not None:
+                    trace.finish('error')
+
+    async def handle_recognized_text(self, session, recognized_text):
         if recognized_text:
-            client_id = self.mqtt_service.get_client_id()
-            print(f"Recognized text from client {client_id}: {recognized_text}")
-            conversation_id = self.conversation_ids.get(client_id)
-            new_conversation_id = self.dify_chat_client.handle_dify_dialog(
+            device_id = session.device_id or self.mqtt_service.get_client_id()
+            logger.info("Recognized text from client %s: %s", device_id, recognized_text)
+            self.expire_conversation(session)
+            session.stream_processor.start_turn(session.turn.trace)
+            new_conversation_id = await self.dify_chat_client.handle_dify_dialog(
                 recognized_text,
-                conversation_id,
-                self.stream_processor
+                session.conversation_id,
+                session.stream_processor,
+                user_id=session.device_id or None
             )
-            if new_conversation_id:
-                self.conversation_ids[client_id] = new_conversation_id
-                print(f"Updated conversation_id for client {client_id}: {new_conversation_id}")
+            self.update_conversation(session, new_conversation_id)
+
+    async def handle_intent(self, session, recognized_text, intent):
+        # 本地指令：先下发机器人指令，再播放确认语（短句由 TTS 缓存直接返回）
+        device_id = session.device_id or self.mqtt_service.get_client_id()
+        logger.info("Recognized text from client %s matches local intent %s: %s", device_id, intent.command,
+                    recognized_text)
+        session.stream_processor.start_turn(session.turn.trace)
+        await session.tts_service.robot_cmd(intent.command)
+        if intent.ack:
+            await session.stream_processor.emit(intent.ack)
+        session.touch()
+
+    async def warm_intent_acks(self):
+        # 启动时把所有确认语合成进 TTS 缓存，第一次命中指令时也不用等合成
+        synthesizer = self.create_synthesizer()
+        try:
+            for ack in {intent.ack for intent in self.intent_matcher.intents if intent.ack}:
+                async for _ in synthesizer.synthesize(ack):
+                    pass
+        except Exception as e:
+            logger.warning("Error warming up intent acknowledgements: %s", e)
+        finally:
+            synthesizer.close()
+
+    def speculate(self, session, text, stream):
+        # 只在还没有对话（第一句或对话被重置后）时投机：Dify 无法撤回消息，在已有对话里取消的投机请求
+        # 仍会留下这句用户没说过的话和部分回答，影响之后的回复；新对话里未命中的请求只留下一个不再使用的空对话。
+        # 上一轮回复还在生成时同样不投机：它的 conversation_id 可能还没返回
+        self.expire_conversation(session)
+        if session.conversation_id or (session.llm_task is not None and not session.llm_task.done()):
+            return None
+        return asyncio.get_running_loop().create_task(self.dify_chat_client.handle_dify_dialog(
+            text,
+            None,
+            stream,
+            user_id=session.device_id or None
+        ))
+
+    async def commit_speculation(self, session, recognized_text, speculation):
+        # 最终结果与投机请求一致：回放已缓存的 LLM 输出并继续接收，不再重新请求
+        device_id = session.device_id or self.mqtt_service.get_client_id()
+        logger.info("Recognized text from client %s (speculative reply): %s", device_id, recognized_text)
+        session.stream_processor.start_turn(session.turn.trace)
+        try:
+            await speculation.stream.commit(session.stream_processor)
+            new_conversation_id = await speculation.task
+        except asyncio.CancelledError:
+            speculation.task.cancel()
+            raise
+        self.update_conversation(session, new_conversation_id)
+
+    def update_conversation(self, session, new_conversation_id):
+        session.touch()
+        session.conversation_updated = time.monotonic()
+        if new_conversation_id:
+            session.conversation_id = new_conversation_id
+            logger.debug("Updated conversation_id for client %s: %s", session.device_id, new_conversation_id)
+
+    def expire_conversation(self, session):
+        if (self.conversation_timeout and session.conversation_id
+                and time.monotonic() - session.conversation_updated > self.conversation_timeout):
+            self.reset_conversation(session.device_id)
 
-    def reset_conversation(self):
-        client_id = self.mqtt_service.get_client_id()
-        if client_id in self.conversation_ids:
-            del self.conversation_ids[client_id]
-            print(f"Conversation reset for client {client_id}")
+    def reset_conversation(self, device_id):
+        session = self.session_manager.sessions.get(device_id)
+        if session and session.conversation_id:
+            session.conversation_id = None
+            logger.info("Conversation reset for client %s", device_id)
 
-    def mqtt_sender(self):
+    async def mqtt_sender(self):
         while True:
-            topic, data = self.data_queue.get()
+            topic, data, token = await self.data_queue.get()
             if topic is None:
                 break
-            self.mqtt_service.publish_data_to_device(topic, data)
+            if token.cancelled:
+                # 被打断的回复，尚未发出的音频直接丢弃
+                self.stats.audio_bytes_dropped += len(data)
+                continue
+            await self.mqtt_service.publish_data_to_device(topic, data)
+            if token.trace is not None:
+                # 本轮第一次发布即结束计时
+                token.trace.mark('mqtt_first_publish')
+                token.trace.finish()
 
     def run(self):
-        sender_thread = threading.Thread(target=self.mqtt_sender, daemon=True)
-        sender_thread.start()
-        self.main()
+        asyncio.run(self.main())
 
 
 if __name__ == "__main__":
+    configure_logging()
     app = Application()
-    app.run()
\ No newline at end of file
+    app.run()
@@ -1,41 +1,181 @@
+import asyncio
+import logging
+
 import paho.mqtt.client as mqtt
-import paho.mqtt.publish as publish
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioHelper:
+    # 将 paho 的 socket 读写挂到 asyncio 事件循环上，替代 loop_forever 线程
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def call(self, callback, *args):
+        # connect 可能在线程池中执行，此时通过 call_soon_threadsafe 转回循环线程；
+        # 在循环线程内则立即执行，保证 socket 关闭前已注销读写监听
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.call(self._add_reader, sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call(self._remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call(self.loop.remove_writer, sock)
+
+    def _add_reader(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def _remove_reader(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc:
+            self.misc.cancel()
+            self.misc = None
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
 
 
 class MQTTService:
-    def __init__(self, broker, port, audio_topic, mic_topic, robot_topic, user, password, client_id):
+    def __init__(self, broker, port, audio_topic, mic_topic, robot_topic, user, password, client_id,
+                 publish_chunk_size=10000, max_inflight=20, connect_timeout=10.0, ctrl_topic=None):
         self.MQTT_BROKER = broker
         self.MQTT_PORT = port
         self.MQTT_AUDIO_TOPIC = audio_topic
         self.MQTT_MIC_TOPIC = mic_topic
         self.MQTT_ROBOT_TOPIC = robot_topic
+        self.MQTT_CTRL_TOPIC = ctrl_topic  # 设备上报能力（音频编码等）的控制主题
         self.MQTT_USER = user
         self.MQTT_PASSWORD = password
         self.MQTT_CLIENT_ID = client_id
+        self.publish_chunk_size = publish_chunk_size
+        self.max_inflight = max_inflight  # 未写入socket的消息上限，超过则等待已有消息发出
+        self.connect_timeout = connect_timeout
+        self.loop = None
+        self.connected = asyncio.Event()
+        self.window_open = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.inflight = 0
+        self.reconnect_task = None
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
                                   client_id=self.MQTT_CLIENT_ID,
                                   clean_session=True,
                                   userdata={'audio_chunks': [], 'conversation_id': None})
         self.client.username_pw_set(self.MQTT_USER, self.MQTT_PASSWORD)
+        self.client.max_inflight_messages_set(self.max_inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
 
     def get_client_id(self):
         return self.MQTT_CLIENT_ID
 
-    def publish_data_to_device(self, topic, data):
-        if data:
-            chunk_size = 10000
-            for start in range(0, len(data), chunk_size):
-                end = start + chunk_size
-                publish.single(topic, data[start:end], hostname=self.MQTT_BROKER, qos=0,
-                               auth={'username': self.MQTT_USER, 'password': self.MQTT_PASSWORD})
+    def mic_device_id(self, topic):
+        # mic 主题为旧版单设备格式，mic/<device_id> 为多设备格式；其它主题返回 None
+        if topic == self.MQTT_MIC_TOPIC:
+            return ""
+        return self.topic_device_id(self.MQTT_MIC_TOPIC, topic)
+
+    def ctrl_device_id(self, topic):
+        if not self.MQTT_CTRL_TOPIC:
+            return None
+        return self.topic_device_id(self.MQTT_CTRL_TOPIC, topic)
+
+    @staticmethod
+    def topic_device_id(base_topic, topic):
+        prefix = base_topic + "/"
+        if topic.startswith(prefix) and topic[len(prefix):] and "/" not in topic[len(prefix):]:
+            return topic[len(prefix):]
+        return None
+
+    async def publish_data_to_device(self, topic, data):
+        # 复用已连接的 self.client 发送，避免每个分片都重新建立 TCP 连接和认证
+        if not data:
+            return
+        if not self.connected.is_set():
+            try:
+                await asyncio.wait_for(self.connected.wait(), self.connect_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("MQTT not connected, dropping %d bytes for %s", len(data), topic)
+                return
+        for start in range(0, len(data), self.publish_chunk_size):
+            end = start + self.publish_chunk_size
+            # 发送窗口控制：窗口满时等待 on_publish 释放，其余发送保持流水线
+            while self.inflight >= self.max_inflight:
+                self.window_open.clear()
+                await self.window_open.wait()
+            self.inflight += 1
+            info = self.client.publish(topic, data[start:end], qos=0)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.inflight -= 1
+                logger.warning("MQTT publish to %s failed: %s", topic, mqtt.error_string(info.rc))
+                return
 
-    def on_connect(self, userdata, connect_flags, reason_code, properties, nil):
-        print("Connected with result code " + str(reason_code))
-        self.client.subscribe(self.MQTT_MIC_TOPIC)
+    def on_publish(self, client, userdata, mid, reason_code, properties):
+        self.inflight = max(0, self.inflight - 1)
+        self.window_open.set()
 
-    def listen_mqtt(self, on_message_callback):
+    def on_connect(self, client, userdata, connect_flags, reason_code, properties):
+        logger.info("Connected with result code %s", reason_code)
+        if reason_code.is_failure:
+            return
+        topics = [(self.MQTT_MIC_TOPIC, 0), (self.MQTT_MIC_TOPIC + "/+", 0)]
+        if self.MQTT_CTRL_TOPIC:
+            topics.append((self.MQTT_CTRL_TOPIC + "/+", 0))
+        self.client.subscribe(topics)
+        self.connected.set()
+
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        logger.warning("Disconnected with result code %s", reason_code)
+        self.connected.clear()
+        # 断线后 QoS 0 的待发消息不会再送达，重置窗口避免发送方一直等待
+        self.inflight = 0
+        self.window_open.set()
+        if not self.stopped.is_set() and not self.reconnect_task:
+            self.reconnect_task = self.loop.create_task(self.reconnect())
+
+    async def reconnect(self, min_delay=1, max_delay=30):
+        delay = min_delay
+        try:
+            while not self.stopped.is_set():
+                await asyncio.sleep(delay)
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    return
+                except OSError as e:
+                    logger.warning("MQTT reconnect failed: %s", e)
+                    delay = min(delay * 2, max_delay)
+        finally:
+            self.reconnect_task = None
+
+    async def listen_mqtt(self, on_message_callback):
+        self.loop = asyncio.get_running_loop()
+        AsyncioHelper(self.loop, self.client)
         self.client.on_message = on_message_callback
-        self.client.connect(self.MQTT_BROKER, self.MQTT_PORT, 60)
-        self.client.on_connect = self.on_connect
-        print("Starting to listen for MQTT messages...")
-        self.client.loop_forever()
+        await self.loop.run_in_executor(None, self.client.connect, self.MQTT_BROKER, self.MQTT_PORT, 60)
+        logger.info("Starting to listen for MQTT messages")
+        await self.stopped.wait()
+
+    def stop(self):
+        self.stopped.set()
+        self.client.disconnect()
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import time
+
+from audio_codec import PCMCodec, create_codec
+from cancellation import CancellationToken, WastedWorkStats
+from uplink import UplinkReassembler, parse_frame
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceSession:
+    def __init__(self, device_id, audio_topic, robot_topic, text_queue_size=4, stats=None, metrics=None):
+        self.device_id = device_id
+        self.audio_topic = audio_topic
+        self.robot_topic = robot_topic
+        self.recognizer = None
+        self.vad = None
+        self.tts_service = None
+        self.stream_processor = None
+        self.codec = PCMCodec()  # 与设备协商的上行（麦克风）音频编码
+        self.downlink_codec = PCMCodec()  # 下行（扬声器）音频编码，设备可以单独声明支持的格式
+        self.uplink = None  # 设备启用上行帧头后才解析
+        self.uplink_idle = 0.5  # 这么久没有新帧时输出重组窗口中剩余的帧
+        self.uplink_deadline = 0.0
+        self.uplink_timer = None
+        self.hello_deadline = None  # 等待设备重新上报能力期间丢弃麦克风数据，编码未知的数据无法识别
+        self.conversation_id = None
+        self.conversation_updated = 0.0  # 上一轮回复结束的时刻
+        self.text_queue = asyncio.Queue(maxsize=text_queue_size)  # STT -> LLM：(文本, 回合追踪, 命中的投机请求)
+        self.tasks = []
+        self.last_active = time.monotonic()
+        self.barge_in_enabled = True
+        self.turn = CancellationToken()
+        self.llm_task = None
+        self.speculator = None  # 开启投机请求时根据识别中间结果提前请求 LLM
+        self.stats = stats or WastedWorkStats()
+        self.metrics = metrics
+        self.trace = None  # 正在说的这句话
+        self.recognizing_trace = None  # 已说完、等待识别结果的那句话
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_for(self, now=None):
+        return (now if now is not None else time.monotonic()) - self.last_active
+
+    def start_task(self, coro):
+        self.tasks.append(asyncio.get_running_loop().create_task(coro))
+
+    def set_codec(self, name, downlink=None):
+        self.codec = create_codec(name)
+        self.downlink_codec = create_codec(downlink or name)
+        if self.tts_service:
+            self.tts_service.codec = self.downlink_codec
+        logger.info("Device %s uses audio codec %s (downlink %s)", self.device_id or '<default>', self.codec.name,
+                    self.downlink_codec.name)
+
+    def process_audio(self, payload):
+        if self.hello_deadline is not None:
+            if time.monotonic() < self.hello_deadline:
+                return
+            self.hello_deadline = None  # 设备没有回应，按旧固件（PCM、无帧头）处理
+        if self.metrics is not None and (self.trace is None or 'speech_end' in self.trace.marks):
+            self.trace = self.metrics.start_trace(self.device_id)
+            self.trace.mark('mic_first_byte')
+        if self.uplink is None:
+            self.feed_audio(self.codec.decode(payload))
+            return
+        # 带帧头的设备：每帧单独解码后交给重组窗口，按序号顺序送入识别
+        frame = parse_frame(payload)
+        if frame is None:
+            return
+        seq, utterance, timestamp, data = frame
+        for audio_chunk in self.uplink.push(seq, utterance, timestamp, self.codec.decode(data)):
+            self.feed_audio(audio_chunk)
+        if self.uplink.pending:
+            # 缺帧时后续帧留在窗口中；设备没有发送说话结束（例如旧固件松开按键）时由定时器输出，
+            # 避免它们等到下一句开始才被送入识别。与识别超时一样只顺延截止时间
+            loop = asyncio.get_running_loop()
+            self.uplink_deadline = loop.time() + self.uplink_idle
+            if self.uplink_timer is None:
+                self.uplink_timer = loop.call_at(self.uplink_deadline, self.on_uplink_idle)
+
+    def on_uplink_idle(self):
+        self.uplink_timer = None
+        if self.uplink is None:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.time() < self.uplink_deadline:
+            self.uplink_timer = loop.call_at(self.uplink_deadline, self.on_uplink_idle)
+            return
+        for audio_chunk in self.uplink.flush():
+            self.feed_audio(audio_chunk)
+
+    def feed_audio(self, audio_chunk):
+        if self.vad is None:
+            self.recognizer.process_audio_chunk(audio_chunk)
+            return
+        # VAD 去掉句首静音，并在检测到句尾静音时立即结束识别，不必等待超时定时器
+        audio, ended = self.vad.process(audio_chunk)
+        if audio:
+            if self.barge_in_enabled and self.responding():
+                self.barge_in()
+            self.recognizer.process_audio_chunk(audio)
+        if ended:
+            self.mark_speech_end()
+            self.recognizer.stop_recognition()
+
+    def mark_speech_end(self):
+        if self.speculator is not None:
+            self.speculator.end_utterance()
+        if self.trace is None or 'speech_end' in self.trace.marks:
+            return
+        self.trace.mark('speech_end')
+        if self.recognizing_trace is not None:
+            self.recognizing_trace.finish('no_text')  # 上一句没有识别出文本
+        self.recognizing_trace = self.trace
+
+    def end_of_speech(self):
+        if self.uplink is not None:
+            for audio_chunk in self.uplink.flush():
+                self.feed_audio(audio_chunk)
+            logger.info("Uplink stats for device %s", self.device_id or '<default>', extra={'fields': self.uplink.stats()})
+        if self.vad is not None:
+            self.vad.reset()
+        self.mark_speech_end()
+        self.recognizer.stop_recognition()
+
+    def submit_text(self, text):
+        # 识别器超时结束时没有单独的说话结束事件，识别结果归属正在说的这句话
+        trace = self.recognizing_trace or self.trace
+        if trace is self.trace:
+            self.trace = None
+        self.recognizing_trace = None
+        if trace is not None:
+            trace.mark('asr_final')
+        speculation = self.speculator.take(text) if self.speculator is not None else None
+        try:
+            self.text_queue.put_nowait((text, trace, speculation))
+        except asyncio.QueueFull:
+            logger.warning("Dropping recognized text for device %s: LLM queue is full", self.device_id or '<default>')
+            if speculation is not None:
+                self.speculator.reject(speculation)
+            if trace is not None:
+                trace.finish('dropped')
+
+    def begin_turn(self, trace=None):
+        # 新一轮回复开始，之前回复残留的工作全部作废
+        self.turn.cancel()
+        self.turn = CancellationToken(trace)
+        if self.tts_service:
+            self.tts_service.start_turn(self.turn)
+        return self.turn
+
+    def responding(self):
+        if self.turn.cancelled:
+            return False
+        if self.llm_task is not None and not self.llm_task.done():
+            return True
+        return self.tts_service is not None and self.tts_service.busy()
+
+    def barge_in(self):
+        # 用户在回复过程中再次开口：停止 LLM 生成、丢弃排队和正在合成的 TTS，以及尚未发布的音频
+        logger.info("Barge-in on device %s, cancelling current reply", self.device_id or '<default>')
+        self.stats.barge_ins += 1
+        self.turn.cancel()
+        if self.llm_task is not None and not self.llm_task.done():
+            self.llm_task.cancel()
+        if self.tts_service:
+            self.tts_service.cancel_pending()
+
+    def close(self):
+        self.turn.cancel()
+        if self.uplink_timer:
+            self.uplink_timer.cancel()
+        if self.speculator is not None:
+            self.speculator.close()
+        if self.recognizer:
+            self.recognizer.close()
+        if self.tts_service:
+            self.tts_service.close()
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+
+class SessionManager:
+    # 按设备 ID 管理会话：每台设备拥有独立的识别器、对话和音频回传主题
+    def __init__(self, audio_topic, robot_topic, session_factory, idle_timeout=300.0, reap_interval=30.0,
+                 stats=None, metrics=None):
+        self.audio_topic = audio_topic
+        self.robot_topic = robot_topic
+        self.session_factory = session_factory
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.sessions = {}
+        # 设备最近一次上报的能力（hello），会话被回收后重建时据此恢复协商结果
+        self.hellos = {}
+        # 已回收的会话和被替换的重组器的上行帧计数，与现有会话的计数相加后导出，计数不会因回收而变小
+        self.retired_uplink = dict.fromkeys(UplinkReassembler.COUNTERS, 0)
+        self.reaper_task = None
+        self.stats = stats or WastedWorkStats()
+        self.metrics = metrics
+
+    def start(self):
+        self.reaper_task = asyncio.get_running_loop().create_task(self.reap_idle_sessions())
+
+    def stop(self):
+        if self.reaper_task:
+            self.reaper_task.cancel()
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+    @staticmethod
+    def device_topic(base_topic, device_id):
+        # 兼容旧固件：没有设备 ID 时仍使用原来的单一主题
+        return f"{base_topic}/{device_id}" if device_id else base_topic
+
+    def get_session(self, device_id):
+        session = self.sessions.get(device_id)
+        if session is None:
+            session = DeviceSession(device_id,
+                                    audio_topic=self.device_topic(self.audio_topic, device_id),
+                                    robot_topic=self.device_topic(self.robot_topic, device_id),
+                                    stats=self.stats, metrics=self.metrics)
+            self.session_factory(session)
+            self.sessions[device_id] = session
+            logger.info("Created session for device %s (%d active)", device_id or '<default>', len(self.sessions))
+        session.touch()
+        return session
+
+    def evict_idle_sessions(self):
+        now = time.monotonic()
+        expired = [device_id for device_id, session in self.sessions.items()
+                   if session.idle_for(now) > self.idle_timeout]
+        for device_id in expired:
+            session = self.sessions.pop(device_id)
+            logger.info("Evicting idle session for device %s", device_id or '<default>')
+            self.retire_uplink(session)
+            session.close()
+        return len(expired)
+
+    def retire_uplink(self, session):
+        if session.uplink is not None:
+            for name, value in session.uplink.counts().items():
+                self.retired_uplink[name] += value
+
+    def uplink_snapshot(self):
+        totals = dict(self.retired_uplink)
+        for session in self.sessions.values():
+            if session.uplink is not None:
+                for name, value in session.uplink.counts().items():
+                    totals[name] += value
+        return {f'uplink_{name}': value for name, value in totals.items()}
+
+    async def reap_idle_sessions(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self.evict_idle_sessions()
+            except Exception as e:
+                logger.exception("Error evicting idle sessions: %s", e)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 比较中间结果和最终结果时忽略标点、空白和大小写：最终结果通常会补上标点
+IGNORED = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    return IGNORED.sub("", text or "").lower()
+
+
+class SpeculationStats:
+    # 投机请求的命中情况；浪费的 token 按被丢弃的请求已经收到的流式增量计
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_tokens = 0
+        self.wasted_chars = 0
+
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def snapshot(self):
+        return {
+            'speculations_started': self.started,
+            'speculation_hits': self.hits,
+            'speculation_misses': self.misses,
+            'speculation_wasted_tokens': self.wasted_tokens,
+            'speculation_wasted_chars': self.wasted_chars,
+        }
+
+
+class SpeculativeStream:
+    # 投机请求的 LLM 输出先缓存，提交后按原顺序转给真正的 StreamProcessor，之后的增量直接转发
+    def __init__(self):
+        self.deltas = deque()
+        self.target = None
+        self.tokens = 0
+        self.chars = 0
+
+    async def process_stream(self, delta):
+        if self.target is not None:
+            await self.target.process_stream(delta)
+            return
+        self.deltas.append(delta)
+        if delta:
+            self.tokens += 1
+            self.chars += len(delta)
+
+    async def commit(self, target):
+        # 回放期间新到的增量也会追加到 deltas，全部回放完才切换为直接转发
+        while self.deltas:
+            await target.process_stream(self.deltas.popleft())
+        self.target = target
+
+
+class Speculation:
+    def __init__(self, text, stream, task):
+        self.text = text
+        self.stream = stream
+        self.task = task
+        self.sealed = False  # 这句话已经说完，只等最终结果
+
+
+class Speculator:
+    # 识别中间结果保持 stable_interval 秒不变（或这句话已经说完）时，用它提前向 LLM 发起请求。
+    # 最终结果与之相同（忽略标点）则直接采用这次请求，省去等待识别收尾的时间；不同则取消，按最终结果重新请求。
+    # 确认之前 LLM 的输出只缓存、不合成。dispatch(text, stream) 返回请求任务，不适合投机时返回 None
+    def __init__(self, dispatch, stable_interval=0.4, stats=None, loop=None):
+        self.dispatch = dispatch
+        self.stable_interval = stable_interval
+        self.stats = stats or SpeculationStats()
+        self.loop = loop or asyncio.get_running_loop()
+        self.hypothesis = ""  # 归一化后的中间结果，用于比较
+        self.hypothesis_text = ""  # 原始的中间结果，作为请求文本
+        self.timer = None
+        self.pending = None
+
+    def on_partial(self, text):
+        key = normalize(text)
+        if not key or key == self.hypothesis:
+            return
+        if self.pending is not None and not self.pending.sealed:
+            # 中间结果又变了，已发出的请求大概率用不上
+            self.discard()
+        elif self.pending is not None:
+            return  # 上一句的请求还在等最终结果，不一致时由 take() 丢弃
+        self.hypothesis = key
+        self.hypothesis_text = text
+        self.cancel_timer()
+        self.timer = self.loop.call_later(self.stable_interval, self.speculate)
+
+    def end_utterance(self):
+        # 说话结束：还没发出请求的话立即用当前中间结果发出，最终结果通常还要再等几百毫秒。
+        # 设备和服务端 VAD 可能各报告一次，重复调用没有影响
+        self.cancel_timer()
+        if self.pending is None and self.hypothesis:
+            self.speculate()
+        if self.pending is not None:
+            self.pending.sealed = True
+        self.hypothesis = ""
+
+    def no_result(self):
+        # 这句话没有识别出文本，不会再有最终结果来确认或丢弃已发出的请求：不清掉的话之后的句子都无法投机
+        self.cancel_timer()
+        self.hypothesis = ""
+        if self.pending is not None and self.pending.sealed:
+            self.discard()
+
+    def speculate(self):
+        self.timer = None
+        if self.pending is not None or not self.hypothesis:
+            return
+        stream = SpeculativeStream()
+        task = self.dispatch(self.hypothesis_text, stream)
+        if task is None:
+            return
+        self.pending = Speculation(self.hypothesis, stream, task)
+        self.stats.started += 1
+        logger.debug("Speculating on partial result: %s", self.hypothesis_text)
+
+    def take(self, text):
+        # 最终结果到达：返回与之一致的投机请求，没有或不一致时返回 None。
+        # 调用方最终采用时调用 accept()，没有采用（命中本地指令等）时调用 reject()
+        self.cancel_timer()
+        self.hypothesis = ""
+        speculation = self.pending
+        if speculation is None:
+            return None
+        if normalize(text) == speculation.text and not speculation.task.cancelled():
+            self.pending = None
+            return speculation
+        self.discard()
+        logger.debug("Speculation missed (%.0f%%): %r != %r", self.stats.hit_rate() * 100, speculation.text, text)
+        return None
+
+    def accept(self, speculation):
+        self.stats.hits += 1
+        logger.debug("Speculation hit (%.0f%%): %s", self.stats.hit_rate() * 100, speculation.text)
+
+    def discard(self):
+        speculation, self.pending = self.pending, None
+        if speculation is not None:
+            self.reject(speculation)
+
+    def reject(self, speculation):
+        self.stats.misses += 1
+        speculation.task.cancel()
+        # 任务结束时再统计，取消前已经在路上的增量也算浪费
+        speculation.task.add_done_callback(lambda task: self.record_waste(speculation.stream))
+
+    def record_waste(self, stream):
+        self.stats.wasted_tokens += stream.tokens
+        self.stats.wasted_chars += stream.chars
+
+    def cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def close(self):
+        self.cancel_timer()
+        if self.pending is not None:
+            self.discard()
@@ -1,30 +1,99 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
 class StreamProcessor:
-    def __init__(self, azure_speech_service):
-        self.azure_speech_service = azure_speech_service
+    # 把 LLM 流式输出切分成 TTS 片段：第一句在遇到任意标点且达到 first_min_chars 时尽早送出，降低首音延迟；
+    # 之后的片段在句末标点处且达到 min_chars 才送出，让合成有更完整的韵律；超过 max_chars 时强制在逗号或空格处切分
+    HARD_BREAKS = "。！？；…!?;\n"
+    SOFT_BREAKS = "，、：,:"
+    CLOSING = "”’」』）)]》\"'"
+    DROPPED = str.maketrans("", "", "*#`")  # Markdown 标记不朗读
+
+    def __init__(self, tts_service, first_min_chars=3, min_chars=20, max_chars=60):
+        self.tts_service = tts_service
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
         self.buffer = ""
-        self.punctuations = ("，。！？；：｡＂＃＄％＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～｟｠｢｣､、〃《》「」『』【】〔〕〖〗〘〙〚〛〜〝〞〟〰〾〿–—''‛""„‟…‧﹏.!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~\r\n\t")
-
-    def process_and_print(self, char):
-        if char.strip() and char not in self.punctuations:
-            self.buffer += char
-        elif char in self.punctuations:
-            if len(self.buffer) >= 20:
-                print(f"***{self.buffer}***{char}")
-                self.azure_speech_service.text_to_speech(self.buffer)
-                self.buffer = ""
-            else:
-                self.buffer += char
-
-    def process_stream(self, lines):
-        if lines is None:
-            if self.buffer and len(self.buffer) > 0:
-                print(f"***{self.buffer}***")
-                self.azure_speech_service.text_to_speech(self.buffer)
-                if len(self.buffer) < 10:
-                    self.azure_speech_service.robot_cmd(self.buffer)
-                self.buffer = ""
-            print("Error: No data provided.")
+        self.reply = []
+        self.segments = 0
+        self.turn_start = None
+        self.first_segment_latency = None
+        self.trace = None
+
+    def start_turn(self, trace=None):
+        self.buffer = ""
+        self.reply = []
+        self.segments = 0
+        self.turn_start = time.perf_counter()
+        self.first_segment_latency = None
+        self.trace = trace
+
+    def is_boundary(self, i):
+        char = self.buffer[i]
+        if char in self.HARD_BREAKS or char in self.SOFT_BREAKS:
+            return True
+        # 英文句点只有后面跟空白时才算句末，避免切开 3.14、e.g. 这类写法；末尾的句点等下一段数据到达再判断
+        return char == '.' and i + 1 < len(self.buffer) and self.buffer[i + 1].isspace()
+
+    def next_boundary(self):
+        target = self.first_min_chars if self.segments == 0 else self.min_chars
+        last_soft = None
+        for i in range(len(self.buffer)):
+            if not self.is_boundary(i):
+                continue
+            end = i + 1
+            while end < len(self.buffer) and self.buffer[end] in self.CLOSING:
+                end += 1
+            hard = self.buffer[i] not in self.SOFT_BREAKS
+            if len(self.buffer[:end].strip()) >= target and (hard or self.segments == 0):
+                return end
+            last_soft = end
+        if len(self.buffer) >= self.max_chars:
+            if last_soft:
+                return last_soft
+            space = self.buffer.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+    async def emit(self, segment):
+        segment = segment.strip()
+        if not segment:
+            return
+        if self.segments == 0 and self.turn_start is not None:
+            self.first_segment_latency = time.perf_counter() - self.turn_start
+            logger.debug("Time to first TTS request: %.0f ms", self.first_segment_latency * 1000)
+            if self.trace is not None:
+                self.trace.mark('tts_first_request')
+        self.segments += 1
+        logger.debug("Segment: %s", segment)
+        await self.tts_service.text_to_speech(segment)
+
+    async def process_stream(self, delta):
+        if delta is None:
+            await self.finish()
             return
-        for line in lines:
-            for char in line:
-                self.process_and_print(char)
\ No newline at end of file
+        if delta and self.trace is not None:
+            self.trace.mark('llm_first_token')
+        # 按整段增量处理，不再逐字符拼接字符串
+        delta = delta.translate(self.DROPPED)
+        self.reply.append(delta)
+        self.buffer += delta
+        end = self.next_boundary()
+        while end is not None:
+            segment, self.buffer = self.buffer[:end], self.buffer[end:]
+            await self.emit(segment)
+            end = self.next_boundary()
+
+    async def finish(self):
+        if self.buffer.strip():
+            await self.emit(self.buffer)
+        self.buffer = ""
+        reply = "".join(self.reply).strip()
+        self.reply = []
+        # 很短的回复视为机器人指令
+        if reply and len(reply) < 10:
+            await self.tts_service.robot_cmd(reply)
@@ -0,0 +1,166 @@
+import asyncio
+import json
+from collections import deque
+
+
+class STTBackend:
+    # 语音识别后端接口：Application 只通过 setup_recognizer / process_audio_chunk / stop_recognition / close 交互，
+    # 所有方法都在事件循环线程中调用，识别结果通过 recognized_callback(text) 回调；
+    # 设置了 partial_callback 时，支持中间结果的后端还会通过 partial_callback(text) 回调识别中的假设；
+    # 一句话结束却没有识别出文本（没听清、识别出错）时回调 no_result_callback()
+    def __init__(self, loop=None, speech_timeout=2.0):
+        self.loop = loop or asyncio.get_running_loop()
+        self.recognized_callback = None
+        self.partial_callback = None
+        self.no_result_callback = None
+        self.speech_timeout = speech_timeout  # 超过该时间没有新的音频输入就认为说话结束
+        self.speech_deadline = 0.0
+        self.timeout_timer = None
+        self.is_recognizing = False
+
+    def setup_recognizer(self, callback, partial_callback=None, no_result_callback=None):
+        self.recognized_callback = callback
+        self.partial_callback = partial_callback
+        self.no_result_callback = no_result_callback
+        self.reset_recognizer()
+
+    def reset_recognizer(self):
+        pass
+
+    def process_audio_chunk(self, audio_chunk):
+        raise NotImplementedError
+
+    def stop_recognition(self):
+        raise NotImplementedError
+
+    def emit_result(self, text):
+        if text and self.recognized_callback:
+            self.recognized_callback(text)
+
+    def emit_final(self, text):
+        # 一句话的最终结果，可能为空
+        if text:
+            self.emit_result(text)
+        elif self.no_result_callback:
+            self.no_result_callback()
+
+    def emit_partial(self, text):
+        if text and self.partial_callback:
+            self.partial_callback(text)
+
+    def start_timeout_timer(self):
+        # 只顺延截止时间，到期时若期间有新音频则重新挂定时器，避免每个音频块都新建定时器
+        self.speech_deadline = self.loop.time() + self.speech_timeout
+        if self.timeout_timer is None:
+            self.timeout_timer = self.loop.call_at(self.speech_deadline, self.on_speech_timeout)
+
+    def on_speech_timeout(self):
+        self.timeout_timer = None
+        if self.loop.time() < self.speech_deadline:
+            self.timeout_timer = self.loop.call_at(self.speech_deadline, self.on_speech_timeout)
+        else:
+            self.stop_recognition()
+
+    def cancel_timeout_timer(self):
+        if self.timeout_timer:
+            self.timeout_timer.cancel()
+            self.timeout_timer = None
+
+    def close(self):
+        self.stop_recognition()
+        self.recognized_callback = None
+        self.partial_callback = None
+        self.no_result_callback = None
+
+
+class StubSTTBackend(STTBackend):
+    # 确定性的离线识别桩：每段语音结束时按顺序返回预设文本，用于本地压测和流水线基准测试
+    def __init__(self, transcripts, loop=None, speech_timeout=2.0):
+        super().__init__(loop=loop, speech_timeout=speech_timeout)
+        self.transcripts = list(transcripts) or [""]
+        self.next_transcript = 0
+        self.utterance_bytes = 0
+        self.total_bytes = 0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            return cls([line.strip() for line in f if line.strip()], **kwargs)
+
+    def process_audio_chunk(self, audio_chunk):
+        self.is_recognizing = True
+        self.utterance_bytes += len(audio_chunk)
+        self.total_bytes += len(audio_chunk)
+        self.emit_partial(self.transcripts[self.next_transcript % len(self.transcripts)])
+        self.start_timeout_timer()
+
+    def stop_recognition(self):
+        self.cancel_timeout_timer()
+        if not self.is_recognizing:
+            return
+        self.is_recognizing = False
+        self.utterance_bytes = 0
+        text = self.transcripts[self.next_transcript % len(self.transcripts)]
+        self.next_transcript += 1
+        self.emit_final(text)
+
+
+class VoskSTTBackend(STTBackend):
+    # 基于 Vosk 的本地离线识别，模型在进程内共享；解码在线程池中执行，不阻塞事件循环
+    models = {}
+
+    def __init__(self, model_path, sample_rate=16000, loop=None, speech_timeout=2.0):
+        super().__init__(loop=loop, speech_timeout=speech_timeout)
+        try:
+            import vosk
+        except ImportError:
+            raise ImportError("VoskSTTBackend requires the 'vosk' package: pip install vosk")
+        self.vosk = vosk
+        if model_path not in self.models:
+            self.models[model_path] = vosk.Model(model_path)
+        self.model = self.models[model_path]
+        self.sample_rate = sample_rate
+        self.recognizer = None
+        self.pending = deque()
+        self.finishing = False
+        self.feeder = None
+
+    def reset_recognizer(self):
+        self.recognizer = self.vosk.KaldiRecognizer(self.model, self.sample_rate)
+
+    def process_audio_chunk(self, audio_chunk):
+        self.is_recognizing = True
+        self.pending.append(bytes(audio_chunk))
+        self.start_timeout_timer()
+        self.ensure_feeder()
+
+    def stop_recognition(self):
+        self.cancel_timeout_timer()
+        if self.is_recognizing:
+            self.finishing = True
+            self.ensure_feeder()
+
+    def ensure_feeder(self):
+        if self.feeder is None or self.feeder.done():
+            self.feeder = self.loop.create_task(self.feed())
+
+    async def feed(self):
+        # 按到达顺序串行送入解码器；Vosk 自身检测到端点时先输出该句
+        while self.pending or self.finishing:
+            if self.pending:
+                audio_chunk = self.pending.popleft()
+                if await self.loop.run_in_executor(None, self.recognizer.AcceptWaveform, audio_chunk):
+                    self.emit_result(json.loads(self.recognizer.Result()).get('text', ''))
+                elif self.partial_callback:
+                    self.emit_partial(json.loads(self.recognizer.PartialResult()).get('partial', ''))
+                continue
+            self.finishing = False
+            self.is_recognizing = False
+            result = await self.loop.run_in_executor(None, self.recognizer.FinalResult)
+            self.emit_final(json.loads(result).get('text', ''))
+            self.reset_recognizer()
+
+    def close(self):
+        super().close()
+        if self.feeder:
+            self.feeder.cancel()
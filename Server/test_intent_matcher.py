@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from intent_matcher import IntentMatcher
+
+INTENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.example.json')
+
+
+class IntentMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = IntentMatcher.from_file(INTENTS)
+
+    def command(self, text):
+        intent = self.matcher.match(text)
+        return intent.command if intent else None
+
+    def test_plain_commands(self):
+        self.assertEqual(self.command("前进"), "前进")
+        self.assertEqual(self.command("向左转。"), "左转")
+        self.assertEqual(self.command("停下来"), "停止")
+
+    def test_polite_commands(self):
+        # 客套词可以比说法本身还长
+        self.assertEqual(self.command("请前进一下"), "前进")
+        self.assertEqual(self.command("请往前走一下"), "前进")
+        self.assertEqual(self.command("麻烦后退一下"), "后退")
+        self.assertEqual(self.command("快停下来！"), "停止")
+        self.assertEqual(self.command("帮我右转吧"), "右转")
+
+    def test_questions_go_to_llm(self):
+        for text in ("停车场在哪", "停电了吗", "今天停课吗", "向前看", "前进吗", "前进的方向是哪边",
+                     "左转还是右转", "不要前进", "别停下"):
+            self.assertIsNone(self.matcher.match(text), text)
+
+    def test_snapshot(self):
+        self.matcher.match("前进")
+        self.matcher.match("前进吗")
+        self.assertEqual(self.matcher.snapshot(), {'intent_matches': 1, 'intent_rejected': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
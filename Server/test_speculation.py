@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+
+from speculation import Speculator
+
+
+class SpeculatorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+        self.speculator = Speculator(self.dispatch, stable_interval=60)
+
+    def dispatch(self, text, stream):
+        task = asyncio.get_running_loop().create_task(asyncio.sleep(60))
+        self.requests.append((text, task))
+        return task
+
+    async def asyncTearDown(self):
+        self.speculator.close()
+        for _, task in self.requests:
+            task.cancel()
+
+    def utterance(self, text):
+        self.speculator.on_partial(text)
+        self.speculator.end_utterance()
+
+    async def test_no_result_clears_sealed_speculation(self):
+        # 没有识别出文本的一句话不能一直占着投机请求
+        self.utterance("今天天气怎么样")
+        self.speculator.no_result()
+        self.assertIsNone(self.speculator.pending)
+        self.assertEqual(self.speculator.stats.misses, 1)
+        self.utterance("讲个笑话")
+        self.assertEqual([text for text, _ in self.requests], ["今天天气怎么样", "讲个笑话"])
+        self.assertIsNotNone(self.speculator.take("讲个笑话。"))
+
+    async def test_rejected_match_counts_as_waste(self):
+        self.utterance("前进")
+        speculation = self.speculator.take("前进")
+        self.assertIsNotNone(speculation)
+        self.speculator.reject(speculation)
+        await asyncio.sleep(0)
+        self.assertTrue(speculation.task.cancelled())
+        self.assertEqual((self.speculator.stats.hits, self.speculator.stats.misses), (0, 1))
+
+    async def test_accepted_match_counts_as_hit(self):
+        self.utterance("讲个笑话")
+        self.speculator.accept(self.speculator.take("讲个笑话！"))
+        self.assertEqual((self.speculator.stats.hits, self.speculator.stats.misses), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from cancellation import CancellationToken
+from tts_backend import ToneTTSBackend
+from tts_service import TTSService
+
+
+class TTSServiceCancelTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.data_queue = asyncio.Queue()
+        self.service = TTSService(ToneTTSBackend(), 'audio', 'robot', self.data_queue, max_lead=0)
+        self.worker = asyncio.get_running_loop().create_task(self.service.tts_worker())
+        await asyncio.sleep(0)
+
+    async def asyncTearDown(self):
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+
+    async def speak(self, text):
+        token = CancellationToken()
+        self.service.start_turn(token)
+        await self.service.text_to_speech(text)
+        return token
+
+    async def wait_idle(self):
+        for _ in range(200):
+            if not self.service.busy():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("TTS service still busy")
+
+    async def test_cancel_before_synthesis_starts(self):
+        # 打断与分派发生在同一轮事件循环：合成任务还没运行第一步就被取消
+        token = await self.speak("你好")
+        await asyncio.sleep(0)  # tts_worker 取出文本并创建合成任务
+        self.assertEqual(len(self.service.synthesis_tasks), 1)
+        token.cancel()
+        self.service.start_turn(CancellationToken())
+        await self.wait_idle()
+        self.assertEqual(self.service.idle_backends, self.service.backends)
+        self.assertFalse(self.service.synthesis_slots.locked())
+
+        # 下一轮回复照常发布
+        while not self.data_queue.empty():
+            self.data_queue.get_nowait()
+        await self.speak("好的")
+        await asyncio.sleep(0)
+        await self.wait_idle()
+        self.assertGreater(self.data_queue.qsize(), 0)
+
+    async def test_cancel_during_synthesis(self):
+        token = await self.speak("今天天气很好")
+        await asyncio.sleep(0.01)
+        token.cancel()
+        self.service.start_turn(CancellationToken())
+        await self.wait_idle()
+        self.assertFalse(self.service.synthesis_slots.locked())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from vad import VoiceActivityDetector
+
+
+def noise(seconds, level_db, rng):
+    return rng.normal(0, 32768 * 10 ** (level_db / 20), int(16000 * seconds))
+
+
+def tone(seconds, level_db):
+    t = np.arange(int(16000 * seconds)) / 16000
+    return np.sin(2 * np.pi * 300 * t) * 32768 * 10 ** (level_db / 20) * np.sqrt(2)
+
+
+def run(vad, signal, chunk_ms=100):
+    data = np.clip(signal, -32768, 32767).astype('<i2').tobytes()
+    step = 32 * chunk_ms
+    forwarded, ends = 0, 0
+    for i in range(0, len(data), step):
+        audio, ended = vad.process(data[i:i + step])
+        forwarded += len(audio)
+        ends += ended
+    return forwarded / 32000, ends
+
+
+class VoiceActivityDetectorNoiseTest(unittest.TestCase):
+    def test_noise_floor_follows_background_noise(self):
+        # 宽带噪声的过零率很高，噪声底不能只靠判为非语音的帧更新
+        rng = np.random.default_rng(0)
+        for level_db in (-50, -45, -40, -35):
+            vad = VoiceActivityDetector()
+            forwarded, _ = run(vad, noise(4, level_db, rng))
+            self.assertAlmostEqual(vad.noise_floor_db, level_db, delta=2)
+            self.assertLess(forwarded, 0.5, level_db)
+
+    def test_utterance_ends_in_noise(self):
+        rng = np.random.default_rng(1)
+        for level_db in (-50, -40):
+            vad = VoiceActivityDetector()
+            run(vad, noise(2, level_db, rng))
+            speech = tone(1, level_db + 20) + noise(1, level_db, rng)
+            forwarded, ends = run(vad, np.concatenate([speech, noise(1, level_db, rng)]))
+            self.assertEqual(ends, 1, level_db)
+            self.assertLess(forwarded, 1.7, level_db)
+
+
+if __name__ == '__main__':
+    unittest.main()
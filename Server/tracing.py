@@ -0,0 +1,150 @@
+import itertools
+import logging
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# 一轮对话的各个阶段，按流水线顺序排列
+STAGES = (
+    'mic_first_byte',      # 收到这句话的第一个麦克风音频包
+    'speech_end',          # 设备上报或服务端 VAD 判断说话结束
+    'asr_final',           # 识别器给出最终文本
+    'llm_first_token',     # Dify 返回第一个非空 token
+    'tts_first_request',   # 第一个片段送入 TTS
+    'tts_first_audio',     # TTS 产出第一个音频块
+    'mqtt_first_publish',  # 第一个音频包发布到 MQTT
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    # Prometheus 风格的累积直方图
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self, name, labels=""):
+        prefix = labels + "," if labels else ""
+        lines = [f'{name}_bucket{{{prefix}le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class TurnMetrics:
+    # 汇总所有设备的回合耗时：每个阶段相对上一个已记录阶段的耗时，以及说话结束到首个音频发布的端到端耗时
+    def __init__(self):
+        self.stage_seconds = {stage: Histogram() for stage in STAGES[1:]}
+        self.turn_seconds = Histogram()
+        self.segment_first_audio = Histogram()  # 每个 TTS 片段从开始合成到第一个音频包进入发布队列
+        self.uplink_delay = Histogram()  # 带帧头的麦克风帧相对最快一帧多花的传输时间（单向延迟抖动）
+        self.turns = {}
+        self.ids = itertools.count(1)
+
+    def start_trace(self, device_id):
+        return TurnTrace(next(self.ids), device_id, self)
+
+    def record(self, trace):
+        self.turns[trace.status] = self.turns.get(trace.status, 0) + 1
+        previous = None
+        for stage in STAGES:
+            at = trace.marks.get(stage)
+            if at is None:
+                continue
+            if previous is not None:
+                self.stage_seconds[stage].observe(max(0.0, at - previous))
+            previous = at
+        end = trace.marks.get('mqtt_first_publish')
+        start = trace.marks.get('speech_end', trace.marks.get('asr_final'))
+        if end is not None and start is not None:
+            self.turn_seconds.observe(max(0.0, end - start))
+
+    def render(self, gauges=None, counters=None):
+        lines = ["# HELP yundo_turn_stage_seconds Time from the previous recorded stage to this stage",
+                 "# TYPE yundo_turn_stage_seconds histogram"]
+        for stage, histogram in self.stage_seconds.items():
+            lines.extend(histogram.render('yundo_turn_stage_seconds', f'stage="{stage}"'))
+        lines += ["# HELP yundo_turn_latency_seconds End of speech to first audio published",
+                  "# TYPE yundo_turn_latency_seconds histogram"]
+        lines.extend(self.turn_seconds.render('yundo_turn_latency_seconds'))
+        lines += ["# HELP yundo_tts_segment_first_audio_seconds TTS segment start to its first audio packet",
+                  "# TYPE yundo_tts_segment_first_audio_seconds histogram"]
+        lines.extend(self.segment_first_audio.render('yundo_tts_segment_first_audio_seconds'))
+        lines += ["# HELP yundo_uplink_delay_seconds Microphone frame transit time above the fastest frame",
+                  "# TYPE yundo_uplink_delay_seconds histogram"]
+        lines.extend(self.uplink_delay.render('yundo_uplink_delay_seconds'))
+        lines += ["# HELP yundo_turns_total Finished turns by outcome", "# TYPE yundo_turns_total counter"]
+        lines.extend(f'yundo_turns_total{{status="{status}"}} {count}' for status, count in self.turns.items())
+        for name, value in (counters or {}).items():
+            lines += [f"# TYPE yundo_{name}_total counter", f"yundo_{name}_total {value}"]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE yundo_{name} gauge", f"yundo_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class TurnTrace:
+    # 一轮对话的时间戳记录：每个阶段只记第一次出现的时刻，回合结束时输出一条带各阶段时间的结构化日志并计入直方图
+    def __init__(self, turn_id, device_id, metrics=None):
+        self.turn_id = turn_id
+        self.device_id = device_id
+        self.metrics = metrics
+        self.marks = {}
+        self.status = None
+
+    def mark(self, stage):
+        if self.status is None and stage not in self.marks:
+            self.marks[stage] = time.perf_counter()
+
+    def finish(self, status='ok'):
+        if self.status is not None:
+            return
+        self.status = status
+        origin = min(self.marks.values(), default=0.0)
+        logger.info("Turn %d finished: %s", self.turn_id, status, extra={'fields': {
+            'turn_id': self.turn_id,
+            'device_id': self.device_id,
+            'status': status,
+            'spans_ms': {stage: round((self.marks[stage] - origin) * 1000, 1) for stage in STAGES if stage in self.marks},
+        }, 'rate_limit': False})
+        if self.metrics is not None:
+            self.metrics.record(self)
+
+
+class MetricsServer:
+    # 以 Prometheus 文本格式在 /metrics 暴露指标；render 为返回文本的回调
+    def __init__(self, render, host='0.0.0.0', port=9464):
+        self.render = render
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info("Metrics available at http://%s:%d/metrics", self.host, self.port)
+
+    async def metrics(self, request):
+        return web.Response(body=self.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import math
+import shlex
+import struct
+
+logger = logging.getLogger(__name__)
+
+
+class TTSBackend:
+    # 语音合成后端接口：synthesize(text) 是异步生成器，按生成顺序产出 16kHz/16bit/单声道 PCM 块
+    sample_rate = 16000
+
+    async def synthesize(self, text):
+        raise NotImplementedError
+        yield
+
+    def close(self):
+        pass
+
+
+class ToneTTSBackend(TTSBackend):
+    # 本地替身引擎：每个字符生成一段固定音高的正弦音，可按实时倍率限速以模拟真实引擎的生成速度，用于离线测试和基准
+    def __init__(self, seconds_per_char=0.15, frequency=440.0, chunk_size=3200, realtime_factor=0.0, amplitude=8000,
+                 latency=0.0):
+        self.seconds_per_char = seconds_per_char
+        self.chunk_size = chunk_size
+        self.realtime_factor = realtime_factor  # 0 表示不限速；0.1 表示生成 1 秒音频耗时 0.1 秒
+        self.latency = latency  # 首个音频块之前的等待，模拟云端合成的请求往返
+        # 预先生成 1 秒的波形，合成时循环截取
+        samples = [int(amplitude * math.sin(2 * math.pi * frequency * i / self.sample_rate))
+                   for i in range(self.sample_rate)]
+        self.waveform = struct.pack(f"<{len(samples)}h", *samples)
+
+    async def synthesize(self, text):
+        total = int(len(text.strip()) * self.seconds_per_char * self.sample_rate) * 2
+        produced = 0
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        while produced < total:
+            size = min(self.chunk_size, total - produced)
+            offset = produced % len(self.waveform)
+            chunk = self.waveform[offset:offset + size]
+            if len(chunk) < size:
+                chunk += self.waveform[:size - len(chunk)]
+            if self.realtime_factor:
+                await asyncio.sleep(size / 2 / self.sample_rate * self.realtime_factor)
+            produced += size
+            yield chunk
+
+
+class CommandTTSBackend(TTSBackend):
+    # 调用本地合成程序（如 piper --output-raw、espeak-ng --stdout 配合 sox 重采样），
+    # 文本通过 stdin 写入，程序须向 stdout 输出 16kHz/16bit/单声道原始 PCM，边生成边读取
+    def __init__(self, command, chunk_size=3200):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.chunk_size = chunk_size
+
+    async def synthesize(self, text):
+        process = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL)
+        try:
+            try:
+                process.stdin.write(text.encode('utf-8') + b"\n")
+                await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 程序不读取 stdin（例如文本通过参数传入）时忽略
+            while True:
+                chunk = await process.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            if await process.wait() != 0:
+                logger.warning("TTS command exited with code %s", process.returncode)
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
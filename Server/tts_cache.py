@@ -0,0 +1,162 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from tts_backend import TTSBackend
+
+
+class TTSCache:
+    # 以 (规范化文本, 音色, 输出格式) 的哈希为键缓存合成好的 PCM，按 LRU 和总字节预算淘汰；
+    # directory 为空时缓存在内存中，否则每条缓存一个文件，重启后仍可命中
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # key -> 内存模式下为 bytes，磁盘模式下为文件大小
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()  # 磁盘模式下 get/put 在线程池中执行
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.load_index()
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize('NFKC', text)
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    @classmethod
+    def make_key(cls, text, voice, output_format):
+        raw = "\0".join((cls.normalize(text), str(voice), str(output_format)))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pcm"):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pcm")
+
+    def entry_size(self, value):
+        return value if isinstance(value, int) else len(value)
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        value = self.entries[key]
+        if not self.directory:
+            self.hits += 1
+            return value
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.total_bytes -= self.entries.pop(key)
+            self.misses += 1
+            return None
+        os.utime(self.path(key))  # 以 mtime 记录最近使用时间，重启后恢复 LRU 顺序
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        with self.lock:
+            self._put(key, data)
+
+    def _put(self, key, data):
+        if not data or len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entry_size(self.entries.pop(key))
+        if self.directory:
+            tmp_path = self.path(key) + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(key))
+            self.entries[key] = len(data)
+        else:
+            self.entries[key] = bytes(data)
+        self.total_bytes += len(data)
+        self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, value = self.entries.popitem(last=False)
+            self.total_bytes -= self.entry_size(value)
+            self.evictions += 1
+            if self.directory:
+                try:
+                    os.remove(self.path(key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+        }
+
+
+class CachedTTSBackend(TTSBackend):
+    # 包装任意合成后端：命中时直接产出缓存的 PCM，不调用合成器；未命中时边合成边产出，完整合成后写入缓存。
+    # 只缓存较短的文本（问候语、确认语、错误提示等常见短句），避免长回复挤占缓存
+    def __init__(self, backend, cache, voice, output_format, max_text_length=20, chunk_size=3200):
+        self.backend = backend
+        self.cache = cache
+        self.voice = voice
+        self.output_format = output_format
+        self.max_text_length = max_text_length
+        self.chunk_size = chunk_size
+
+    async def synthesize(self, text):
+        if len(TTSCache.normalize(text)) > self.max_text_length:
+            async with contextlib.aclosing(self.backend.synthesize(text)) as stream:
+                async for chunk in stream:
+                    yield chunk
+            return
+
+        key = TTSCache.make_key(text, self.voice, self.output_format)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.cache.get, key) if self.cache.directory else self.cache.get(key)
+        if data is not None:
+            view = memoryview(data)
+            for start in range(0, len(view), self.chunk_size):
+                yield bytes(view[start:start + self.chunk_size])
+            return
+
+        # 被打断时生成器在 yield 处关闭，不完整的音频不会写入缓存
+        audio = bytearray()
+        async with contextlib.aclosing(self.backend.synthesize(text)) as stream:
+            async for chunk in stream:
+                audio += chunk
+                yield chunk
+        if self.cache.directory:
+            await loop.run_in_executor(None, self.cache.put, key, bytes(audio))
+        else:
+            self.cache.put(key, audio)
+
+    def close(self):
+        self.backend.close()
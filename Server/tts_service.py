@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+
+from audio_chunker import StreamingChunker
+from audio_codec import PCMCodec
+from cancellation import CancellationToken, WastedWorkStats
+
+logger = logging.getLogger(__name__)
+
+
+class TTSService:
+    # 会话级的合成阶段：从 tts_queue 取文本，最多 concurrency 段同时交给各自的 TTSBackend 实例合成，
+    # 再由 emit_worker 严格按入队顺序编码并放入发布队列——第 N 段边合成边发送时，第 N+1 段已经在合成。
+    # 合成器实例按需通过 backend_factory 创建，最多 concurrency 个（一个合成器同一时间只合成一段）。
+    # 每条文本和音频都带上所属回复的 CancellationToken，回复被打断后排队中的文本和音频直接丢弃
+    def __init__(self, backend, mqtt_audio_topic, robot_topic, data_queue, tts_queue_size=16, stats=None,
+                 concurrency=1, backend_factory=None, metrics=None, max_lead=0.7):
+        self.backend = backend
+        self.backend_factory = backend_factory
+        self.backends = [backend]
+        self.idle_backends = [backend]
+        self.concurrency = max(1, concurrency) if backend_factory else 1
+        self.synthesis_slots = asyncio.Semaphore(self.concurrency)
+        self.synthesis_tasks = {}  # 正在合成的任务 -> 所属回复的 token
+        # 已开始合成、等待按顺序输出的片段 (token, 音频块队列, 开始合成的时刻)
+        self.segments = asyncio.Queue(maxsize=self.concurrency)
+        self.pending = 0  # 已从 tts_queue 取出但还没输出完的片段数
+        self.mqtt_audio_topic = mqtt_audio_topic
+        self.mqtt_robot_topic = robot_topic
+        self.data_queue = data_queue
+        self.tts_queue = asyncio.Queue(maxsize=tts_queue_size)
+        # 首包 100ms，之后逐步增大到 300ms (16kHz, 16-bit)，不超过固件的 MQTT 接收缓冲（10240 字节）；每个包编码成一个数据包。
+        # 编码器状态跨包延续（Opus），所以只在按序输出时编码；包大小按 Opus 帧对齐，中途不会补静音。
+        # 合成通常快于实时，按 max_lead 秒的设备缓冲限速发送，固件 1 秒的抖动缓冲区（含 200ms 预缓冲）不会溢出
+        self.chunker = StreamingChunker(first_bytes=3200, max_bytes=9600, max_lead=max_lead)
+        self.emitted_token = None
+        self.codec = PCMCodec()
+        self.token = CancellationToken()
+        self.stats = stats or WastedWorkStats()
+        self.metrics = metrics  # 每段的首音延迟计入 TurnMetrics
+
+    def start_turn(self, token):
+        self.token = token
+        self.cancel_pending()  # 上一轮回复的 token 已取消，停止它还在进行的合成
+
+    def busy(self):
+        return self.pending > 0 or not self.tts_queue.empty()
+
+    def cancel_pending(self):
+        # 清空尚未开始合成的文本，并停止属于已取消回复的合成任务（关闭生成器，后端随之停止合成）
+        for task, token in list(self.synthesis_tasks.items()):
+            if token.cancelled:
+                task.cancel()
+        while True:
+            try:
+                text, _ = self.tts_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            self.stats.tts_segments_dropped += 1
+            self.stats.tts_chars_dropped += len(text)
+            self.tts_queue.task_done()
+
+    async def text_to_speech(self, text):
+        logger.debug("Queueing text for synthesis: %s", text)
+        await self.tts_queue.put((text, self.token))
+
+    async def tts_worker(self):
+        emitter = asyncio.get_running_loop().create_task(self.emit_worker())
+        try:
+            while True:
+                text, token = await self.tts_queue.get()
+                self.tts_queue.task_done()
+                self.pending += 1
+                # 等待空闲的合成器，限制同时合成的片段数
+                await self.synthesis_slots.acquire()
+                if token.cancelled:
+                    self.synthesis_slots.release()
+                    self.pending -= 1
+                    self.stats.tts_segments_dropped += 1
+                    self.stats.tts_chars_dropped += len(text)
+                    continue
+                logger.debug("Processing text-to-speech for: %s", text)
+                backend = self.idle_backends.pop() if self.idle_backends else self.add_backend()
+                chunks = asyncio.Queue()
+                started = time.perf_counter()
+                task = asyncio.get_running_loop().create_task(self.synthesize_segment(backend, text, token, chunks))
+                self.synthesis_tasks[task] = token
+                # 收尾放在完成回调里：任务在第一次运行前就被取消时协程体（包括 finally）根本不会执行
+                task.add_done_callback(functools.partial(self.finish_segment, backend, chunks))
+                await self.segments.put((token, chunks, started))
+        finally:
+            emitter.cancel()
+            for task in list(self.synthesis_tasks):
+                task.cancel()
+
+    def add_backend(self):
+        backend = self.backend_factory()
+        self.backends.append(backend)
+        logger.debug("Created synthesizer %d of %d", len(self.backends), self.concurrency)
+        return backend
+
+    def finish_segment(self, backend, chunks, task):
+        # 不论成功、出错还是被取消都放入结束标记并归还合成器，emit_worker 才能继续输出下一段
+        self.synthesis_tasks.pop(task, None)
+        self.idle_backends.append(backend)
+        self.synthesis_slots.release()
+        chunks.put_nowait(None)
+
+    async def synthesize_segment(self, backend, text, token, chunks):
+        # 合成结果放入本片段自己的队列，结束标记由 finish_segment 放入
+        start = time.perf_counter()
+        first_byte = None
+        try:
+            async with contextlib.aclosing(backend.synthesize(text)) as audio_stream:
+                async for audio_data in audio_stream:
+                    if token.cancelled:
+                        logger.info("Synthesis interrupted for: %s", text)
+                        break
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                        logger.debug("Time to first audio byte: %.0f ms", first_byte * 1000)
+                        if token.trace is not None:
+                            token.trace.mark('tts_first_audio')
+                    chunks.put_nowait(audio_data)
+        except asyncio.CancelledError:
+            logger.info("Synthesis interrupted for: %s", text)
+        except Exception as e:
+            logger.exception("An error occurred during synthesis: %s", e)
+        return first_byte
+
+    async def emit_worker(self):
+        while True:
+            token, chunks, started = await self.segments.get()
+            try:
+                await self.emit_segment(token, chunks, started)
+            finally:
+                self.pending -= 1
+
+    async def emit_segment(self, token, chunks, started):
+        # 按块转发本片段的音频，由 chunker 切成逐渐变大的数据包；回复被取消后只丢弃不再发送
+        if token is not self.emitted_token:
+            self.emitted_token = token
+            self.chunker.start_turn()
+        first_packet = None
+        dropped = 0
+        while True:
+            audio_data = await chunks.get()
+            if audio_data is None:
+                break
+            if token.cancelled:
+                dropped += len(audio_data)
+                continue
+            for packet in self.chunker.push(audio_data):
+                await self.send_packet(packet, token)
+                if first_packet is None:
+                    first_packet = time.perf_counter() - started
+        if token.cancelled:
+            self.stats.tts_segments_dropped += 1
+            self.stats.audio_bytes_dropped += dropped + self.chunker.count
+            self.chunker.clear()
+            return
+        for packet in self.chunker.flush():
+            await self.send_packet(packet, token)
+            if first_packet is None:
+                first_packet = time.perf_counter() - started
+        if first_packet is not None:
+            logger.debug("Segment time to first audio packet: %.0f ms", first_packet * 1000)
+            if self.metrics is not None:
+                self.metrics.segment_first_audio.observe(first_packet)
+
+    async def send_packet(self, pcm, token):
+        delay = self.chunker.send_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if token.cancelled:
+            self.stats.audio_bytes_dropped += len(pcm)  # 等待期间被打断
+            return
+        await self.publish_audio(pcm, token)
+
+    async def publish_audio(self, pcm, token):
+        logger.debug("Sending %d bytes of audio data to MQTT queue", len(pcm))
+        await self.data_queue.put((self.mqtt_audio_topic, self.codec.encode(pcm), token))
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+    async def robot_cmd(self, cmd):
+        logger.info("发送命令到机器人: %s %s", cmd, self.mqtt_robot_topic)
+        await self.data_queue.put((self.mqtt_robot_topic, cmd, self.token))
@@ -0,0 +1,116 @@
+import struct
+import time
+from collections import deque
+
+# 与固件 AudioSystem 的上行帧头一致：序号 uint16、语句编号 uint16、采集时间 ms uint32，小端
+FRAME_HEADER = struct.Struct('<HHI')
+
+
+def parse_frame(payload):
+    # 返回 (seq, utterance, timestamp_ms, 音频数据)，长度不足一个帧头时返回 None
+    if len(payload) < FRAME_HEADER.size:
+        return None
+    seq, utterance, timestamp = FRAME_HEADER.unpack_from(payload)
+    return seq, utterance, timestamp, payload[FRAME_HEADER.size:]
+
+
+class UplinkReassembler:
+    # 按序号重组 QoS 0 的麦克风帧：在 window 帧的窗口内重排乱序帧，丢弃重复帧和来得太晚的帧，
+    # 窗口被后续帧顶满时用等长静音填补缺失帧，保证送入识别器的音频时间轴连续。
+    # 设备时钟与服务端不同步，延迟统计用“到达时间 - 采集时间”相对最小值的增量（单向延迟抖动）；
+    # 传入 delay_histogram 时每帧的延迟同时计入所有设备共用的直方图
+    COUNTERS = ('frames', 'lost', 'duplicates', 'late', 'reordered')
+
+    def __init__(self, window=4, delay_histogram=None):
+        self.window = window
+        self.delay_histogram = delay_histogram
+        self.utterance = None
+        self.expected_seq = None
+        self.pending = {}
+        self.concealed = deque(maxlen=64)  # 最近用静音填补的序号，用来区分迟到帧和重复帧
+        self.frame_bytes = 0
+        self.min_transit = None
+        self.frames = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+        self.delay_sum = 0.0
+        self.delay_max = 0.0
+
+    def push(self, seq, utterance, timestamp, audio):
+        # 返回可以按顺序送入识别器的音频块列表
+        ready = []
+        if self.utterance is not None and 0 < (self.utterance - utterance) & 0xFFFF < 0x8000:
+            self.late += 1  # 上一句迟到的帧
+            return ready
+        if utterance != self.utterance:
+            ready.extend(self.flush())
+            self.utterance = utterance
+            self.expected_seq = seq
+        self.record_delay(timestamp)
+        offset = (seq - self.expected_seq) & 0xFFFF
+        if offset >= 0x8000:
+            # 序号落在已输出的部分：已被静音填补的是迟到帧，否则是重复帧
+            if seq in self.concealed:
+                self.late += 1
+            else:
+                self.duplicates += 1
+            return ready
+        if seq in self.pending:
+            self.duplicates += 1
+            return ready
+        if offset:
+            self.reordered += 1
+        self.frames += 1
+        self.frame_bytes = max(self.frame_bytes, len(audio))
+        self.pending[seq] = audio
+        ready.extend(self.drain(force=False))
+        return ready
+
+    def drain(self, force):
+        ready = []
+        while self.pending:
+            audio = self.pending.pop(self.expected_seq, None)
+            if audio is None:
+                newest = max((s - self.expected_seq) & 0xFFFF for s in self.pending)
+                if not force and newest < self.window:
+                    break
+                # 缺失帧：用静音占位，保持时间轴连续
+                self.lost += 1
+                self.concealed.append(self.expected_seq)
+                audio = bytes(self.frame_bytes)
+            ready.append(audio)
+            self.expected_seq = (self.expected_seq + 1) & 0xFFFF
+        return ready
+
+    def flush(self):
+        # 语句结束或切换到新语句时，输出窗口中剩余的帧
+        return self.drain(force=True)
+
+    def record_delay(self, timestamp):
+        transit = time.monotonic() * 1000 - timestamp
+        if self.min_transit is None or transit < self.min_transit or transit - self.min_transit > 60000:
+            # 首帧、延迟创新低，或设备计时回绕/重启时重新取基线
+            self.min_transit = transit
+        delay = transit - self.min_transit
+        self.delay_sum += delay
+        self.delay_max = max(self.delay_max, delay)
+        if self.delay_histogram is not None:
+            self.delay_histogram.observe(delay / 1000)
+
+    def counts(self):
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def stats(self):
+        received = self.frames + self.duplicates + self.late
+        return {
+            'frames': self.frames,
+            'lost': self.lost,
+            'duplicates': self.duplicates,
+            'late': self.late,
+            'reordered': self.reordered,
+            'loss_rate': self.lost / (self.frames + self.lost) if self.frames + self.lost else 0.0,
+            'delay_avg_ms': self.delay_sum / received if received else 0.0,
+            'delay_max_ms': self.delay_max,
+        }
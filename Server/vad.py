@@ -0,0 +1,89 @@
+from collections import deque
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    # 流式语音活动检测：16kHz/16bit 单声道 PCM 按 20ms 分帧，用能量 + 过零率判定语音帧（整块向量化计算）。
+    # 语音开始前只保留一小段预录音频，检测到语音后连同预录一起送入识别；
+    # 语音后连续静音超过 hangover_ms 即判定一句话结束。
+    # 噪声底取最近 noise_window_ms 内所有帧能量的 noise_percentile 分位数，与帧的判定结果无关：
+    # 若只用判为非语音的帧更新，噪声较大时每帧都被判为语音，噪声底永远停在初值
+    def __init__(self, sample_rate=16000, frame_ms=20, energy_margin_db=10.0, min_energy_db=-55.0,
+                 zcr_threshold=0.25, zcr_margin_db=6.0, start_frames=3, hangover_ms=300, preroll_ms=300,
+                 noise_window_ms=3000, noise_percentile=10, noise_seed_ms=200):
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.energy_margin_db = energy_margin_db  # 语音帧能量需高出噪声底的分贝数
+        self.min_energy_db = min_energy_db  # 绝对能量下限，避免安静环境下噪声底过低导致误触发
+        self.zcr_threshold = zcr_threshold  # 清辅音（s、sh 等）能量低但过零率高
+        self.zcr_margin_db = zcr_margin_db
+        self.start_frames = start_frames  # 连续多少帧语音才认为开始说话
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.noise_history = deque(maxlen=max(1, noise_window_ms // frame_ms))  # 最近各帧的能量 (dB)
+        self.noise_percentile = noise_percentile
+        self.noise_seed_frames = max(1, noise_seed_ms // frame_ms)  # 攒够这么多帧才开始估计，之前使用 min_energy_db
+        self.noise_floor_db = min_energy_db
+        self.remainder = b""
+        self.preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def reset(self):
+        self.remainder = b""
+        self.preroll.clear()
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def classify(self, frames):
+        # frames: (n, frame_samples) int16，返回每帧是否为语音
+        x = frames.astype(np.float32) * (1.0 / 32768.0)
+        energy_db = 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / self.frame_samples
+        # 先用本块更新噪声底，持续的背景噪声也会计入
+        self.noise_history.extend(energy_db.tolist())
+        if len(self.noise_history) >= self.noise_seed_frames:
+            self.noise_floor_db = float(np.percentile(self.noise_history, self.noise_percentile))
+        threshold = max(self.noise_floor_db + self.energy_margin_db, self.min_energy_db)
+        # 过零率规则同样要求能量明显高于噪声底，宽带噪声的过零率也很高
+        zcr_threshold_db = max(threshold - self.zcr_margin_db, self.min_energy_db)
+        speech = (energy_db > threshold) | ((energy_db > zcr_threshold_db) & (zcr > self.zcr_threshold))
+        return speech
+
+    def process(self, audio_chunk):
+        # 返回 (需要送入识别器的音频, 是否检测到一句话结束)
+        data = self.remainder + bytes(audio_chunk) if self.remainder else bytes(audio_chunk)
+        frame_count = len(data) // self.frame_bytes
+        self.remainder = data[frame_count * self.frame_bytes:]
+        if not frame_count:
+            return b"", False
+        frames = np.frombuffer(data, dtype='<i2', count=frame_count * self.frame_samples).reshape(
+            frame_count, self.frame_samples)
+        speech = self.classify(frames)
+
+        forwarded = []
+        ended = False
+        for i, is_speech in enumerate(speech.tolist()):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if ended:
+                # 本块内一句话已结束，剩余帧留作下一句的预录，下一次调用再判断是否开始说话
+                self.preroll.append(frame)
+                continue
+            if not self.in_speech:
+                self.preroll.append(frame)
+                self.speech_run = self.speech_run + 1 if is_speech else 0
+                if self.speech_run >= self.start_frames:
+                    self.in_speech = True
+                    self.silence_run = 0
+                    forwarded.extend(self.preroll)
+                    self.preroll.clear()
+                continue
+            forwarded.append(frame)
+            self.silence_run = 0 if is_speech else self.silence_run + 1
+            if self.silence_run >= self.hangover_frames:
+                self.in_speech = False
+                self.speech_run = 0
+                ended = True
+        return b"".join(forwarded), ended